@@ -0,0 +1,160 @@
+import os
+import copy
+import json
+import logging
+
+import numpy as np
+from scipy import sparse
+
+# ==========================
+# Приближённый поиск ближайших соседей (IVF)
+# ==========================
+# Векторы (L2-нормированные, сравниваются скалярным произведением) разбиваются k-means на nlist
+# кластеров. Запрос сравнивается с центроидами и сканирует только nprobe ближайших списков:
+# больше nprobe — выше полнота, дольше запрос. Новые векторы добавляются в списки без переобучения.
+
+_FILES = ("centroids", "offsets", "ids", "vectors")
+_META_FILE = "ann_meta.json"
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, block_size: int = 65536) -> np.ndarray:
+    """Номер ближайшего центроида для каждого вектора (по блокам, чтобы не держать всю матрицу оценок)"""
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_size):
+        assign[start:start + block_size] = np.argmax(vectors[start:start + block_size] @ centroids.T, axis=1)
+    return assign
+
+
+def _spherical_kmeans(vectors: np.ndarray, k: int, iterations: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = np.array(vectors[rng.choice(len(vectors), k, replace=False)], dtype=np.float32)
+    for _ in range(iterations):
+        assign = _nearest_centroids(vectors, centroids)
+        membership = sparse.csr_matrix(
+            (np.ones(len(vectors), dtype=np.float32), (assign, np.arange(len(vectors)))),
+            shape=(k, len(vectors)),
+        )
+        sums = np.asarray(membership @ vectors, dtype=np.float32)
+        empty = np.flatnonzero(np.bincount(assign, minlength=k) == 0)
+        # Пустые кластеры заново засеваем случайными векторами
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = np.divide(sums, norms, out=np.zeros_like(sums), where=norms > 0)
+    return centroids
+
+
+class IVFIndex:
+    """Инвертированные списки по кластерам k-means над векторами float32"""
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray, vectors: np.ndarray):
+        self.centroids = centroids      # nlist x dim
+        self.offsets = offsets          # nlist + 1: границы списков в ids/vectors
+        self.ids = ids                  # номера векторов, упорядоченные по спискам
+        self.vectors = vectors          # векторы в том же порядке, что ids
+        # Добавленные после построения: (номер, вектор, номер списка), сливаются в списки при сохранении
+        self._added_ids: list[int] = []
+        self._added_vectors: list[np.ndarray] = []
+        self._added_lists: list[int] = []
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.ids) + len(self._added_ids)
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, nlist: int, iterations: int = 10, sample_size: int = 100000,
+              seed: int = 0) -> "IVFIndex":
+        """Обучает центроиды на выборке и раскладывает все векторы по спискам"""
+        nlist = max(1, min(nlist, len(vectors)))
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if len(vectors) > sample_size:
+            sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        centroids = _spherical_kmeans(np.asarray(sample, dtype=np.float32), nlist, iterations, seed)
+        index = cls(centroids, np.zeros(nlist + 1, dtype=np.int64),
+                    np.zeros(0, dtype=np.int64), np.zeros((0, vectors.shape[1]), dtype=np.float32))
+        index._rebuild_lists(np.arange(len(vectors), dtype=np.int64), np.asarray(vectors, dtype=np.float32),
+                             _nearest_centroids(vectors, centroids))
+        return index
+
+    def _rebuild_lists(self, ids: np.ndarray, vectors: np.ndarray, assign: np.ndarray):
+        order = np.argsort(assign, kind="stable")
+        self.ids = ids[order]
+        self.vectors = vectors[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=self.nlist))]).astype(np.int64)
+
+    def add(self, ids, vectors: np.ndarray):
+        """Добавляет векторы в ближайшие списки без переобучения центроидов"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        self._added_ids.extend(int(i) for i in np.atleast_1d(ids))
+        self._added_vectors.extend(vectors)
+        self._added_lists.extend(int(c) for c in _nearest_centroids(vectors, self.centroids))
+
+    def extended(self, ids, vectors: np.ndarray) -> "IVFIndex":
+        """Копия с добавленными векторами; основные списки общие, сам индекс не меняется (для снимков FaqIndex)"""
+        index = copy.copy(self)
+        index._added_ids = list(self._added_ids)
+        index._added_vectors = list(self._added_vectors)
+        index._added_lists = list(self._added_lists)
+        index.add(ids, vectors)
+        return index
+
+    def compact(self):
+        """Сливает добавленные векторы в основные списки"""
+        if not self._added_ids:
+            return
+        assign = np.repeat(np.arange(self.nlist, dtype=np.int32), np.diff(self.offsets))
+        self._rebuild_lists(
+            np.concatenate([self.ids, np.array(self._added_ids, dtype=np.int64)]),
+            np.vstack([self.vectors, np.array(self._added_vectors, dtype=np.float32)]),
+            np.concatenate([assign, np.array(self._added_lists, dtype=np.int32)]),
+        )
+        self._added_ids, self._added_vectors, self._added_lists = [], [], []
+
+    def search(self, vector: np.ndarray, top_k: int, nprobe: int) -> tuple[np.ndarray, np.ndarray]:
+        """top_k ближайших по скалярному произведению среди nprobe ближайших списков: (номера, оценки)"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        probe = np.argpartition(-(self.centroids @ vector), nprobe - 1)[:nprobe]
+        ids = [self.ids[self.offsets[c]:self.offsets[c + 1]] for c in probe]
+        scores = [self.vectors[self.offsets[c]:self.offsets[c + 1]] @ vector for c in probe]
+        if self._added_ids:
+            probed = set(probe.tolist())
+            extra = [j for j, c in enumerate(self._added_lists) if c in probed]
+            if extra:
+                ids.append(np.array([self._added_ids[j] for j in extra], dtype=np.int64))
+                scores.append(np.array([self._added_vectors[j] for j in extra], dtype=np.float32) @ vector)
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores).astype(np.float32)
+        if len(scores) > top_k:
+            part = np.argpartition(-scores, top_k - 1)[:top_k]
+            ids, scores = ids[part], scores[part]
+        return ids, scores
+
+    # ==========================
+    # Хранение на диске
+    # ==========================
+    def save(self, index_dir: str, prefix: str = "ann_"):
+        self.compact()
+        os.makedirs(index_dir, exist_ok=True)
+        for name in _FILES:
+            path = os.path.join(index_dir, f"{prefix}{name}.npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(getattr(self, name)))
+            os.replace(path + ".tmp", path)
+        meta_path = os.path.join(index_dir, prefix + _META_FILE)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"nlist": self.nlist, "size": len(self.ids)}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    @classmethod
+    def load(cls, index_dir: str, prefix: str = "ann_") -> "IVFIndex | None":
+        if not os.path.exists(os.path.join(index_dir, prefix + _META_FILE)):
+            return None
+        try:
+            arrays = {name: np.load(os.path.join(index_dir, f"{prefix}{name}.npy"), mmap_mode="r") for name in _FILES}
+        except (OSError, ValueError) as e:
+            logging.warning(f"[ANN] Не удалось загрузить IVF-индекс из {index_dir}: {e}")
+            return None
+        return cls(np.array(arrays["centroids"]), np.array(arrays["offsets"]), arrays["ids"], arrays["vectors"])
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+
+from . import db_async
+from .nlp_utils import TIER_EXACT
+from .search_service import search_service
+
+# ==========================
+# Повторный поиск ответов для вопросов без ответа
+# ==========================
+# После синхронизации FAQ вопросы, на которые раньше не нашлось ответа (unanswered_questions
+# и личные таблицы пользователей), прогоняются через пакетный поиск. Уверенно найденным
+# проставляется ответ и статус 'green'. Таблицы читаются страницами по id, поэтому в памяти
+# не больше одной страницы, а пакеты идут в общий пул поиска по одному и не занимают его целиком.
+
+BACKLOG_BATCH_SIZE = 256    # Вопросов в одном пакете поиска
+BACKLOG_MIN_SCORE = 0.8     # Ответ засчитывается, если средняя оценка лучшего варианта не ниже...
+BACKLOG_MIN_METHODS = 3     # ...и его нашли не меньше стольких методов (точное совпадение засчитывается всегда)
+
+
+def _matched_question(results) -> str | None:
+    if not results:
+        return None
+    question, avg, count, _, _, tier = results[0]
+    if tier == TIER_EXACT:
+        return question
+    return question if avg >= BACKLOG_MIN_SCORE and count >= BACKLOG_MIN_METHODS else None
+
+
+async def rematch_backlog(batch_size: int = BACKLOG_BATCH_SIZE) -> tuple[int, int]:
+    """Проходит все вопросы без ответа; возвращает (проверено, найден ответ)"""
+    started = time.perf_counter()
+    scanned = matched = 0
+    for table_name in await db_async.get_backlog_tables():
+        after_id = 0
+        while True:
+            rows = await db_async.get_backlog_page(table_name, after_id, batch_size)
+            if not rows:
+                break
+            after_id = rows[-1][0]
+            results = await search_service.find_similar_batch([question for _, question in rows])
+            found = {row_id: q for (row_id, _), res in zip(rows, results) if (q := _matched_question(res))}
+            if found:
+                answers = await db_async.get_faq_answers(set(found.values()))
+                updates = [(answers[q], row_id) for row_id, q in found.items() if q in answers]
+                await db_async.mark_backlog_answered(table_name, updates)
+                matched += len(updates)
+            scanned += len(rows)
+    elapsed = time.perf_counter() - started
+    logging.info(f"[Backlog] Проверено вопросов: {scanned}, найден ответ: {matched} за {elapsed:.1f} с "
+                 f"({scanned / elapsed if elapsed else 0:.0f} вопросов/с)")
+    return scanned, matched
+
+
+async def run_backlog_job():
+    """rematch_backlog как фоновая задача: ошибки пишутся в лог и не роняют бота"""
+    try:
+        await rematch_backlog()
+    except asyncio.CancelledError:
+        logging.info("[Backlog] Повторный поиск прерван")
+        raise
+    except Exception as e:
+        logging.error(f"[Backlog] Ошибка повторного поиска: {e}")
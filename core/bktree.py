@@ -0,0 +1,69 @@
+from rapidfuzz.distance import Levenshtein
+
+# ==========================
+# Индекс для поиска по расстоянию Левенштейна
+# ==========================
+# Строки раскладываются по длине (при расстоянии <= k длины отличаются не больше чем на k),
+# внутри каждой корзины — BK-дерево. Дерево отсекает поддеревья по неравенству треугольника,
+# а расстояние считается с score_cutoff, чтобы не досчитывать заведомо далёкие пары.
+
+
+class BKTree:
+    """BK-дерево над строками; узел — [строка, номера элементов, {расстояние: потомок}]"""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, text: str, item: int):
+        if self.root is None:
+            self.root = [text, [item], {}]
+            return
+        node = self.root
+        while True:
+            dist = Levenshtein.distance(text, node[0])
+            if dist == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [text, [item], {}]
+                return
+            node = child
+
+    def search(self, query: str, max_dist: int) -> list[tuple[int, int]]:
+        """Все элементы на расстоянии <= max_dist: [(номер элемента, расстояние), ...]"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            text, items, children = stack.pop()
+            # Дальше max(ключей потомков) + max_dist ни узел, ни его потомки подойти не могут
+            cutoff = max_dist + max(children, default=0)
+            dist = Levenshtein.distance(query, text, score_cutoff=cutoff)
+            if dist > cutoff:
+                continue
+            if dist <= max_dist:
+                found.extend((item, dist) for item in items)
+            for child_dist, child in children.items():
+                if abs(child_dist - dist) <= max_dist:
+                    stack.append(child)
+        return found
+
+
+class EditDistanceIndex:
+    """BK-деревья, разложенные по длине строки"""
+
+    def __init__(self, texts: list[str]):
+        self.buckets: dict[int, BKTree] = {}
+        for item, text in enumerate(texts):
+            self.buckets.setdefault(len(text), BKTree()).add(text, item)
+
+    def search(self, query: str, max_dist: int) -> list[tuple[int, int]]:
+        """Все строки на расстоянии <= max_dist от query: [(номер строки, расстояние), ...]"""
+        found = []
+        for length in range(max(len(query) - max_dist, 0), len(query) + max_dist + 1):
+            tree = self.buckets.get(length)
+            if tree is not None:
+                found.extend(tree.search(query, max_dist))
+        return found
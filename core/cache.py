@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ==========================
+# LRU-кэш с TTL
+# ==========================
+
+
+class LRUCache:
+    """
+    Ограниченный по числу записей LRU-кэш с временем жизни записей и счётчиками попаданий.
+    Потокобезопасен. Ключи — строки/числа или кортежи из них (нужно для сохранения в JSON).
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()  # ключ -> [значение, истекает_в, число_попаданий]
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            entry[2] += 1
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            entry = self._data.get(key)
+            self._data[key] = [value, expires, entry[2] if entry is not None else 0]
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> str:
+        return f"записей {len(self._data)}/{self.maxsize}, попаданий {self.hits}, промахов {self.misses} ({self.hit_rate:.1%})"
+
+    # ==========================
+    # Сохранение горячих записей между перезапусками
+    # ==========================
+    def dump(self, path: str, limit: int):
+        """Сохраняет limit самых востребованных непросроченных записей в JSON"""
+        now = time.monotonic()
+        with self._lock:
+            alive = [(k, e) for k, e in self._data.items() if e[1] is None or e[1] >= now]
+        alive.sort(key=lambda item: item[1][2], reverse=True)
+        rows = [[_to_json(k), _to_json(e[0]), e[2]] for k, e in alive[:limit]]
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        logging.info(f"[Cache] Сохранено записей: {len(rows)} -> {path}")
+
+    def load(self, path: str) -> int:
+        """Загружает записи, сохранённые dump(); TTL отсчитывается заново"""
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"[Cache] Не удалось загрузить {path}: {e}")
+            return 0
+        for key, value, hits in reversed(rows):
+            self.put(_from_json(key), _from_json(value))
+            self._data[_from_json(key)][2] = hits
+        return len(rows)
+
+
+def _to_json(value):
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, list):
+        return tuple(_from_json(v) for v in value)
+    return value
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from .database import get_unanswered_for_clustering, save_question_clusters
+from .minhash import MinHasher, MinHashLSH, estimate_jaccard
+from .nlp_utils import preprocess_text
+
+# ==========================
+# Кластеры похожих вопросов без ответа
+# ==========================
+# Вопрос без ответа относится к кластеру, если оценка Жаккара (MinHash по множеству стемов)
+# с представителем кластера не ниже CLUSTER_THRESHOLD; иначе он сам становится
+# представителем нового кластера. Номер кластера — id строки представителя в unanswered_questions.
+# В LSH-индексе лежат только представители, поэтому память растёт с числом кластеров, а не вопросов.
+
+CLUSTER_NUM_PERM = 64       # Длина сигнатуры MinHash
+CLUSTER_BANDS = 32          # Полос LSH (CLUSTER_NUM_PERM / CLUSTER_BANDS позиций в полосе)
+CLUSTER_THRESHOLD = 0.4     # Минимальная оценка Жаккара с представителем кластера
+# Вопросы короткие: два-три слова вежливости («подскажите», «срочно») уже опускают Жаккар
+# переформулировок до 0.4-0.5, поэтому полосы узкие (по 2 позиции), а порог проверяется точно.
+
+
+def question_shingles(question: str) -> set[str]:
+    """Шинглы вопроса — его стемы; вопрос только из стоп-слов — символьные триграммы"""
+    stems = set(preprocess_text(question).split())
+    if not stems and question.strip():
+        padded = f" {question.lower().strip()} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    return stems
+
+
+class QuestionClusters:
+    """LSH-индекс представителей кластеров; assign вызывается при записи каждого вопроса без ответа"""
+
+    def __init__(self):
+        self._hasher = MinHasher(CLUSTER_NUM_PERM)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._lsh = MinHashLSH(CLUSTER_NUM_PERM, CLUSTER_BANDS)
+        self._representatives: dict[int, np.ndarray] = {}   # номер кластера -> сигнатура представителя
+
+    def __len__(self):
+        return len(self._representatives)
+
+    def _assign(self, signature: np.ndarray, row_id: int) -> int:
+        best, best_score = None, CLUSTER_THRESHOLD
+        for cluster_id in self._lsh.query(signature):
+            score = estimate_jaccard(signature, self._representatives[cluster_id])
+            if score >= best_score:
+                best, best_score = cluster_id, score
+        if best is None:
+            best = row_id
+            self._representatives[row_id] = signature
+            self._lsh.add(signature, row_id)
+        return best
+
+    def assign(self, question: str, row_id: int) -> int:
+        """Номер кластера для только что записанного вопроса (row_id — его id в unanswered_questions)"""
+        signature = self._hasher.signature(question_shingles(question))
+        with self._lock:
+            return self._assign(signature, row_id)
+
+    def rebuild(self, rows: list[tuple[int, str, int | None]]) -> list[tuple[int, int]]:
+        """
+        Восстанавливает индекс по строкам (id, вопрос, cluster_id) в порядке id.
+        Строки без cluster_id распределяются по кластерам; возвращает [(cluster_id, id), ...] для них.
+        """
+        started = time.perf_counter()
+        signatures = self._hasher.signatures([question_shingles(q) for _, q, _ in rows])
+        assigned = []
+        with self._lock:
+            self._reset()
+            for (row_id, _, cluster_id), signature in zip(rows, signatures):
+                if cluster_id is None:
+                    assigned.append((self._assign(signature, row_id), row_id))
+                elif cluster_id == row_id:
+                    self._representatives[row_id] = signature
+                    self._lsh.add(signature, row_id)
+        logging.info(f"[Clusters] {len(rows)} вопросов без ответа, кластеров {len(self)}, "
+                     f"распределено новых {len(assigned)} за {time.perf_counter() - started:.2f} с")
+        return assigned
+
+
+question_clusters = QuestionClusters()
+
+
+def load_question_clusters():
+    """При старте: восстанавливает индекс кластеров и проставляет кластеры строкам, записанным без него"""
+    assigned = question_clusters.rebuild(get_unanswered_for_clustering())
+    save_question_clusters(assigned)
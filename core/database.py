@@ -1,12 +1,58 @@
 import sqlite3
 import os
 import logging
-import pandas as pd
+import math
+import threading
+import time
 import hashlib
+from contextlib import closing
+
+from .faq_reader import iter_faq_rows
 
 logger = logging.getLogger(__name__)
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'bot_data.db')
 
+# ==========================
+# Подключения
+# ==========================
+# У каждого потока одно долгоживущее подключение (sqlite3 не даёт делить его между потоками).
+# WAL: читатели не ждут писателя; synchronous=NORMAL: fsync только при чекпойнте WAL;
+# cached_statements: разобранные запросы переиспользуются между вызовами функций.
+# Асинхронные обёртки над функциями модуля — в db_async.
+SQLITE_CACHE_KB = 16384         # Кэш страниц на подключение
+SQLITE_CACHED_STATEMENTS = 256  # Подготовленных запросов в кэше подключения
+SQLITE_BUSY_TIMEOUT = 5.0       # Сколько ждать блокировку записи, секунд
+
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []   # все открытые подключения, чтобы закрыть их при остановке
+_connections_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """Подключение текущего потока; `with _connect() as conn` — транзакция (commit/rollback), без закрытия"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        # check_same_thread=False только ради close_connections из основного потока при остановке;
+        # запросы через подключение выполняет лишь поток-владелец
+        conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT, cached_statements=SQLITE_CACHED_STATEMENTS,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _local.conn, _local.path = conn, DB_PATH
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def close_connections():
+    """Закрывает все подключения; вызывается, когда потоки, работающие с БД, уже остановлены"""
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+
 
 
 
@@ -15,15 +61,93 @@ def generate_question_hash(question: str) -> str:
 
 
 def get_question_by_hash(question_hash: str) -> str:
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         cur = conn.cursor()
         cur.execute("SELECT question FROM faq WHERE question_hash = ?", (question_hash,))
         row = cur.fetchone()
         return row[0] if row else None
 
 
+def _ensure_column(cur: sqlite3.Cursor, table: str, column: str, decl: str):
+    """Добавляет колонку в существующую таблицу (миграция старых баз)"""
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# ==========================
+# Полнотекстовый индекс FAQ (FTS5)
+# ==========================
+# faq_fts — FTS5-таблица с внешним содержимым над faq.tokens (стемы из preprocess_text);
+# триггеры обновляют её при любом изменении faq, поэтому индекс общий для всех процессов,
+# работающих с bot_data.db, и не требует перестроения. Ранжирование — bm25().
+# faq_fts_vocab (fts5vocab) отдаёт число строк с термом — по нему считается idf стемов запроса,
+# чтобы перевести bm25 в абсолютную шкалу (fts_idf).
+def _ensure_faq_fts(cur: sqlite3.Cursor):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'faq_fts'")
+    if cur.fetchone():
+        cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS faq_fts_vocab USING fts5vocab(faq_fts, row)")
+        return
+    try:
+        cur.execute("CREATE VIRTUAL TABLE faq_fts USING fts5(tokens, content='faq', content_rowid='id')")
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 недоступен в этой сборке SQLite, полнотекстовый поиск отключён: {e}")
+        return
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS faq_fts_ai AFTER INSERT ON faq BEGIN
+                       INSERT INTO faq_fts (rowid, tokens) VALUES (new.id, new.tokens);
+                   END''')
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS faq_fts_ad AFTER DELETE ON faq BEGIN
+                       INSERT INTO faq_fts (faq_fts, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+                   END''')
+    cur.execute('''CREATE TRIGGER IF NOT EXISTS faq_fts_au AFTER UPDATE ON faq BEGIN
+                       INSERT INTO faq_fts (faq_fts, rowid, tokens) VALUES ('delete', old.id, old.tokens);
+                       INSERT INTO faq_fts (rowid, tokens) VALUES (new.id, new.tokens);
+                   END''')
+    cur.execute("INSERT INTO faq_fts (faq_fts) VALUES ('rebuild')")
+    cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS faq_fts_vocab USING fts5vocab(faq_fts, row)")
+    logger.info("Создан полнотекстовый индекс faq_fts")
+
+
+def fts_search(stems: list[str], limit: int) -> list[tuple[int, float]]:
+    """
+    Вопросы FAQ, содержащие хотя бы один из стемов, по убыванию релевантности:
+    [(faq.id, bm25), ...]; bm25 отрицательный, чем меньше — тем релевантнее
+    """
+    if not stems:
+        return []
+    query = " OR ".join('"' + stem.replace('"', '""') + '"' for stem in stems)
+    with _connect() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT rowid, bm25(faq_fts) FROM faq_fts WHERE faq_fts MATCH ? ORDER BY rank LIMIT ?",
+                        (query, limit))
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Полнотекстовый поиск недоступен: {e}")
+            return []
+        return cur.fetchall()
+
+
+def fts_idf(stems: list[str], total: int) -> list[float]:
+    """
+    idf стемов так же, как его считает bm25() FTS5: log((N - n + 0.5) / (n + 0.5)), не меньше 1e-6,
+    где N = total — строк в FAQ (передаёт вызывающий, чтобы не считать COUNT(*) по таблице на каждый запрос),
+    n — строк со стемом. Стем, которого нет ни в одной строке, получает наибольший idf.
+    """
+    if not stems:
+        return []
+    with _connect() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SELECT term, doc FROM faq_fts_vocab WHERE term IN ({','.join('?' * len(stems))})", stems)
+            docs = dict(cur.fetchall())
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Полнотекстовый поиск недоступен: {e}")
+            return []
+    return [max(1e-6, math.log((total - docs.get(stem, 0) + 0.5) / (docs.get(stem, 0) + 0.5))) for stem in stems]
+
+
 def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         cur = conn.cursor()
         cur.execute('''CREATE TABLE IF NOT EXISTS users (
                         user_id INTEGER PRIMARY KEY,
@@ -36,62 +160,193 @@ def init_db():
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         question TEXT UNIQUE,
                         answer TEXT,
-                        question_hash TEXT UNIQUE
+                        question_hash TEXT UNIQUE,
+                        tokens TEXT,
+                        content_hash TEXT
                     )''')
+        _ensure_column(cur, 'faq', 'tokens', 'TEXT')
+        _ensure_column(cur, 'faq', 'content_hash', 'TEXT')
+        _ensure_faq_fts(cur)
         cur.execute('''CREATE TABLE IF NOT EXISTS unanswered_questions (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         question TEXT,
+                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        answer TEXT,
+                        status TEXT DEFAULT 'yellow',
+                        cluster_id INTEGER
+                    )''')
+        _ensure_column(cur, 'unanswered_questions', 'answer', 'TEXT')
+        _ensure_column(cur, 'unanswered_questions', 'status', "TEXT DEFAULT 'yellow'")
+        _ensure_column(cur, 'unanswered_questions', 'cluster_id', 'INTEGER')
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_unanswered_cluster ON unanswered_questions (cluster_id, status)")
+        # Кластеры похожих вопросов без ответа: id — id вопроса-представителя
+        cur.execute('''CREATE TABLE IF NOT EXISTS unanswered_clusters (
+                        id INTEGER PRIMARY KEY,
+                        representative TEXT,
+                        count INTEGER DEFAULT 0,
+                        last_seen DATETIME
+                    )''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS user_questions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        question TEXT,
+                        answer TEXT,
+                        status TEXT CHECK(status IN ('green','yellow','red')) DEFAULT 'yellow',
                         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
                     )''')
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_questions_status ON user_questions (user_id, status)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_user_questions_user ON user_questions (user_id, id)")
+        cur.execute('''CREATE TABLE IF NOT EXISTS meta (
+                        key TEXT PRIMARY KEY,
+                        value TEXT
+                    )''')
+        # Раньше вопросы без ответа записывались прямо в faq (answer = NULL) — переносим их в свою таблицу
+        cur.execute("INSERT INTO unanswered_questions (question) SELECT question FROM faq WHERE answer IS NULL")
+        if cur.rowcount:
+            logger.info(f"Вопросы без ответа перенесены из faq в unanswered_questions: {cur.rowcount}")
+            cur.execute("DELETE FROM faq WHERE answer IS NULL")
+            bump_faq_version(cur)
         conn.commit()
         logger.info("База данных инициализирована")
 
 
+def get_faq_version() -> int:
+    """Версия содержимого FAQ; меняется при каждом изменении вопросов или ответов"""
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT value FROM meta WHERE key = 'faq_version'")
+        row = cur.fetchone()
+        return int(row[0]) if row else 0
+
+
+def bump_faq_version(cur: sqlite3.Cursor):
+    """Увеличивает версию FAQ в рамках текущей транзакции; вызывать после любого изменения faq"""
+    cur.execute('''INSERT INTO meta (key, value) VALUES ('faq_version', 1)
+                   ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1''')
+
+
+def generate_content_hash(question: str, answer: str) -> str:
+    """Хэш содержимого строки FAQ: меняется при изменении вопроса или ответа"""
+    return hashlib.sha256(f"{question}\0{answer}".encode()).hexdigest()[:16]
+
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _get_meta(cur: sqlite3.Cursor, key: str) -> str | None:
+    cur.execute("SELECT value FROM meta WHERE key = ?", (key,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(cur: sqlite3.Cursor, key: str, value: str):
+    cur.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value))
+
+
 def merge_faq_from_excel(file_path: str) -> tuple[int, int]:
+    """
+    Синхронизирует FAQ с файлом (xlsx, csv или tsv с колонками question и answer);
+    возвращает (новых, изменённых) строк. Файл читается потоково, порциями — в одной транзакции.
+    Файл с теми же mtime и размером, что при прошлой синхронизации, не читается вовсе; если они изменились,
+    сравнивается хэш файла (mtime, размер и хэш хранятся в meta), и только при новом хэше файл разбирается —
+    в БД пишутся лишь строки, у которых изменился хэш содержимого.
+    """
+    from .nlp_utils import preprocess_text
+
     if not os.path.exists(file_path):
-        raise FileNotFoundError(f"Excel-файл {file_path} не найден")
+        raise FileNotFoundError(f"FAQ-файл {file_path} не найден")
 
     try:
-        df = pd.read_excel(file_path)
-        if 'question' not in df.columns or 'answer' not in df.columns:
-            raise ValueError("Excel должен содержать колонки 'question' и 'answer'")
+        started = time.perf_counter()
+        stat = os.stat(file_path)
+        mtime, size = str(stat.st_mtime_ns), str(stat.st_size)
 
-        new_entries = 0
-        updated_entries = 0
-
-        with sqlite3.connect(DB_PATH) as conn:
+        with _connect() as conn:
             cur = conn.cursor()
             cur.execute('''CREATE TABLE IF NOT EXISTS faq (
                             id INTEGER PRIMARY KEY AUTOINCREMENT,
                             question TEXT UNIQUE,
                             answer TEXT,
-                            question_hash TEXT UNIQUE
+                            question_hash TEXT UNIQUE,
+                            tokens TEXT,
+                            content_hash TEXT
+                        )''')
+            _ensure_column(cur, 'faq', 'tokens', 'TEXT')
+            _ensure_column(cur, 'faq', 'content_hash', 'TEXT')
+            cur.execute('''CREATE TABLE IF NOT EXISTS meta (
+                            key TEXT PRIMARY KEY,
+                            value TEXT
                         )''')
 
-            for _, row in df.iterrows():
-                question = str(row['question']).strip().replace('#', '')
-                answer = str(row['answer']).strip().replace('#', '')
-
-                if not question:
-                    continue
-
-                question_hash = generate_question_hash(question)
-
-                cur.execute("SELECT id FROM faq WHERE question = ?", (question,))
-                if cur.fetchone():
-                    cur.execute('''UPDATE faq SET 
-                                answer = ?, 
-                                question_hash = ?
-                                WHERE question = ?''',
-                                (answer, question_hash, question))
-                    updated_entries += 1
-                else:
-                    cur.execute('''INSERT INTO faq 
-                                  (question, answer, question_hash) 
-                                  VALUES (?, ?, ?)''',
-                                (question, answer, question_hash))
-                    new_entries += 1
+            stored_hash = _get_meta(cur, 'faq_import_hash')
+            if (stored_hash is not None and _get_meta(cur, 'faq_import_mtime') == mtime
+                    and _get_meta(cur, 'faq_import_size') == size):
+                logger.info(f"FAQ-файл не изменился с прошлой синхронизации (mtime и размер те же), импорт пропущен "
+                            f"({(time.perf_counter() - started) * 1000:.0f} мс)")
+                return 0, 0
+
+            file_hash = _file_hash(file_path)
+            if stored_hash == file_hash:
+                # Файл только перезаписали тем же содержимым — запоминаем новые mtime и размер
+                _set_meta(cur, 'faq_import_mtime', mtime)
+                _set_meta(cur, 'faq_import_size', size)
+                conn.commit()
+                logger.info(f"FAQ-файл не изменился с прошлой синхронизации, импорт пропущен "
+                            f"({(time.perf_counter() - started) * 1000:.0f} мс)")
+                return 0, 0
+
+            rows_total = changed_total = new_entries = updated_entries = 0
+            with closing(iter_faq_rows(file_path)) as chunks:
+                for chunk in chunks:
+                    # Последняя строка с тем же вопросом перекрывает предыдущие, как при построчной записи
+                    rows = dict(chunk)
+                    questions = list(rows)
+                    stored = {}
+                    for start in range(0, len(questions), 500):
+                        part = questions[start:start + 500]
+                        cur.execute(f"SELECT question, content_hash FROM faq "
+                                    f"WHERE question IN ({','.join('?' * len(part))})", part)
+                        stored.update(cur.fetchall())
+                    changed = []
+                    for question, answer in rows.items():
+                        content_hash = generate_content_hash(question, answer)
+                        if question not in stored:
+                            new_entries += 1
+                        elif stored[question] != content_hash:
+                            updated_entries += 1
+                        else:
+                            continue
+                        changed.append((question, answer, generate_question_hash(question),
+                                        preprocess_text(question), content_hash))
+
+                    cur.executemany('''INSERT INTO faq (question, answer, question_hash, tokens, content_hash)
+                                       VALUES (?, ?, ?, ?, ?)
+                                       ON CONFLICT(question) DO UPDATE SET
+                                           answer = excluded.answer,
+                                           question_hash = excluded.question_hash,
+                                           tokens = excluded.tokens,
+                                           content_hash = excluded.content_hash''', changed)
+                    rows_total += len(chunk)
+                    changed_total += len(changed)
+
+            # Строки, добавленные до появления колонки tokens
+            cur.execute("SELECT id, question FROM faq WHERE tokens IS NULL")
+            cur.executemany("UPDATE faq SET tokens = ? WHERE id = ?",
+                            [(preprocess_text(q), faq_id) for faq_id, q in cur.fetchall()])
+            if changed_total:
+                bump_faq_version(cur)
+            _set_meta(cur, 'faq_import_mtime', mtime)
+            _set_meta(cur, 'faq_import_size', size)
+            _set_meta(cur, 'faq_import_hash', file_hash)
             conn.commit()
+        logger.info(f"FAQ-файл: строк {rows_total}, без изменений {rows_total - changed_total}, "
+                    f"за {time.perf_counter() - started:.2f} с")
         return new_entries, updated_entries
 
     except Exception as e:
@@ -100,147 +355,337 @@ def merge_faq_from_excel(file_path: str) -> tuple[int, int]:
 
 
 def get_all_faq_questions():
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         cur = conn.cursor()
         cur.execute("SELECT question FROM faq WHERE answer IS NOT NULL")
         return [row[0] for row in cur.fetchall()]
 
 
-def log_unanswered_question(question: str):
-    with sqlite3.connect(DB_PATH) as conn:
+def count_answered_faq() -> int:
+    """Число вопросов FAQ с ответом"""
+    with _connect() as conn:
         cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO unanswered_questions (question) VALUES (?)",
-            (question,)
-        )
-        conn.commit()
+        cur.execute("SELECT COUNT(*) FROM faq WHERE answer IS NOT NULL")
+        return cur.fetchone()[0]
 
 
-def get_faq_answer(question: str) -> str | None:
+def get_faq_answers_by_hash(hashes) -> dict[str, str]:
+    """Ответы по question_hash одним запросом (порциями по 500 параметров): {question_hash: ответ}"""
+    hashes = list(hashes)
+    answers = {}
+    with _connect() as conn:
+        cur = conn.cursor()
+        for start in range(0, len(hashes), 500):
+            part = hashes[start:start + 500]
+            cur.execute(f"SELECT question_hash, answer FROM faq WHERE answer IS NOT NULL "
+                        f"AND question_hash IN ({','.join('?' * len(part))})", part)
+            answers.update(cur.fetchall())
+    return answers
+
+
+def get_faq_answer_by_hash(question_hash: str) -> str | None:
+    """Ответ на вопрос FAQ по его question_hash; None — такого вопроса с ответом нет"""
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT answer FROM faq WHERE question_hash = ? AND answer IS NOT NULL", (question_hash,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+def iter_answered_faq(chunk_size: int = 1000):
+    """Вопросы FAQ с ответом порциями [(вопрос, ответ), ...] прямо из курсора (для выгрузки)"""
+    cur = _connect().cursor()
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT answer FROM faq WHERE question = ?", (question,))
-            row = cur.fetchone()
-            return row[0] if row else None
-    except sqlite3.Error as e:
-        logging.error(f"Database error in get_faq_answer: {e}")
-        return None
+        cur.execute("SELECT question, answer FROM faq WHERE answer IS NOT NULL ORDER BY id")
+        while rows := cur.fetchmany(chunk_size):
+            yield rows
+    finally:
+        cur.close()
 
-def insert_faq_question(question: str):
-    question_hash = generate_question_hash(question)
-    with sqlite3.connect(DB_PATH) as conn:
+
+def get_meta_value(key: str) -> str | None:
+    with _connect() as conn:
+        return _get_meta(conn.cursor(), key)
+
+
+def set_meta_value(key: str, value: str):
+    with _connect() as conn:
+        _set_meta(conn.cursor(), key, value)
+        conn.commit()
+
+
+def get_all_faq_entries() -> list[tuple[int, str, str | None, str | None]]:
+    """Вопросы FAQ с ответом: (id, вопрос, нормализованная форма tokens, question_hash)"""
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, question, tokens, question_hash FROM faq WHERE answer IS NOT NULL ORDER BY id")
+        return cur.fetchall()
+
+
+def get_faq_answers(questions) -> dict[str, str]:
+    """Ответы на несколько вопросов FAQ одним запросом (порциями по 500 параметров): {вопрос: ответ}"""
+    questions = list(questions)
+    answers = {}
+    with _connect() as conn:
+        cur = conn.cursor()
+        for start in range(0, len(questions), 500):
+            part = questions[start:start + 500]
+            cur.execute(f"SELECT question, answer FROM faq WHERE answer IS NOT NULL "
+                        f"AND question IN ({','.join('?' * len(part))})", part)
+            answers.update(cur.fetchall())
+    return answers
+
+
+# ==========================
+# Очередь вопросов без ответа (unanswered_questions и user_questions)
+# ==========================
+def get_backlog_tables() -> list[str]:
+    """Таблицы, в которых копятся вопросы без ответа (и ещё не перенесённые личные таблицы)"""
+    with _connect() as conn:
+        cur = conn.cursor()
+        return ['unanswered_questions', 'user_questions'] + [name for _, name in _legacy_questions_tables(cur)]
+
+
+def get_backlog_page(table_name: str, after_id: int, limit: int) -> list[tuple[int, str]]:
+    """Следующие limit вопросов без ответа с id > after_id (постранично по ключу, без OFFSET)"""
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT id, question FROM {table_name} "
+                    f"WHERE id > ? AND answer IS NULL AND status = 'yellow' ORDER BY id LIMIT ?",
+                    (after_id, limit))
+        return cur.fetchall()
+
+
+def mark_backlog_answered(table_name: str, answers: list[tuple[str, int]]):
+    """Проставляет найденные ответы: [(ответ, id), ...] -> status 'green'"""
+    with _connect() as conn:
         cur = conn.cursor()
-        cur.execute('''INSERT OR IGNORE INTO faq 
-                     (question, answer, question_hash) 
-                     VALUES (?, NULL, ?)''',
-                    (question, question_hash))
+        cur.executemany(f"UPDATE {table_name} SET answer = ?, status = 'green' WHERE id = ?", answers)
         conn.commit()
 
 
-def is_user_registered(user_id: int) -> bool:
-    with sqlite3.connect(DB_PATH) as conn:
+def _insert_unanswered(cur: sqlite3.Cursor, questions: list[str]):
+    """Записывает вопросы без ответа и сразу относит каждый к кластеру похожих вопросов"""
+    from .clustering import question_clusters
+    if not cur.connection.in_transaction:
+        cur.execute("BEGIN IMMEDIATE")   # блокировка записи до чтения MAX(id)
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM unanswered_questions")
+    last_id = cur.fetchone()[0]
+    cur.executemany("INSERT INTO unanswered_questions (question) VALUES (?)", [(q,) for q in questions])
+    # Блокировка записи взята до MAX(id), поэтому строки с id > last_id — только что вставленные
+    cur.execute("SELECT id, question FROM unanswered_questions WHERE id > ? ORDER BY id", (last_id,))
+    assigned = [(question_clusters.assign(q, row_id), row_id, q) for row_id, q in cur.fetchall()]
+    cur.executemany("UPDATE unanswered_questions SET cluster_id = ? WHERE id = ?",
+                    [(cluster_id, row_id) for cluster_id, row_id, _ in assigned])
+    cur.executemany('''INSERT INTO unanswered_clusters (id, representative, count, last_seen)
+                       VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+                       ON CONFLICT(id) DO UPDATE SET count = count + 1, last_seen = CURRENT_TIMESTAMP''',
+                    [(cluster_id, q) for cluster_id, _, q in assigned])
+
+
+def log_unanswered_question(question: str):
+    with _connect() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-        return cur.fetchone() is not None
+        _insert_unanswered(cur, [question])
+        conn.commit()
 
 
-def insert_user(user_id: int, username: str, phone: str, full_name: str):
-    with sqlite3.connect(DB_PATH) as conn:
+def write_question_batch(unanswered: list[str], user_questions: list[tuple[int, str, str | None, str]]):
+    """
+    Пакет отложенных записей одной транзакцией: вопросы без ответа и вопросы пользователей
+    [(user_id, вопрос, ответ, статус), ...] (см. write_behind)
+    """
+    with _connect() as conn:
         cur = conn.cursor()
-        cur.execute(
-            "INSERT OR REPLACE INTO users (user_id, username, phone, full_name) VALUES (?, ?, ?, ?)",
-            (user_id, username, phone, full_name)
-        )
+        if unanswered:
+            _insert_unanswered(cur, unanswered)
+        cur.executemany("INSERT INTO user_questions (user_id, question, answer, status) VALUES (?, ?, ?, ?)",
+                        user_questions)
         conn.commit()
 
 
-# novoe
+def get_unanswered_for_clustering() -> list[tuple[int, str, int | None]]:
+    """Все вопросы без ответа для восстановления кластеров: (id, вопрос, cluster_id) по возрастанию id"""
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, question, cluster_id FROM unanswered_questions ORDER BY id")
+        return cur.fetchall()
+
+
+def save_question_clusters(assigned: list[tuple[int, int]]):
+    """Проставляет cluster_id строкам [(cluster_id, id), ...] и пересчитывает счётчики кластеров"""
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.executemany("UPDATE unanswered_questions SET cluster_id = ? WHERE id = ?", assigned)
+        cur.execute("DELETE FROM unanswered_clusters")
+        cur.execute('''INSERT INTO unanswered_clusters (id, representative, count, last_seen)
+                       SELECT u.cluster_id, r.question, COUNT(*), MAX(u.timestamp)
+                       FROM unanswered_questions u JOIN unanswered_questions r ON r.id = u.cluster_id
+                       GROUP BY u.cluster_id''')
+        conn.commit()
+
+
+def get_operator_queue(limit: int = 50) -> list[tuple[int, str, int, str]]:
+    """
+    Очередь оператора: по одному представителю на кластер, в котором остались вопросы без ответа,
+    самые частые сначала: [(cluster_id, вопрос-представитель, сколько раз спрашивали, когда последний раз), ...]
+    """
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute('''SELECT c.id, c.representative, c.count, c.last_seen FROM unanswered_clusters c
+                       WHERE EXISTS (SELECT 1 FROM unanswered_questions u
+                                     WHERE u.cluster_id = c.id AND u.status = 'yellow')
+                       ORDER BY c.count DESC, c.last_seen DESC LIMIT ?''', (limit,))
+        return cur.fetchall()
+
+
 def insert_user(user_id: int, username: str, phone: str, full_name: str):
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         cur = conn.cursor()
+        # Повторная регистрация обновляет контакт, не трогая questions_table (ещё не перенесённую таблицу вопросов)
         cur.execute(
-            "INSERT OR REPLACE INTO users (user_id, username, phone, full_name) VALUES (?, ?, ?, ?)",
+            """INSERT INTO users (user_id, username, phone, full_name) VALUES (?, ?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET
+                   username = excluded.username,
+                   phone = excluded.phone,
+                   full_name = excluded.full_name""",
             (user_id, username, phone, full_name)
         )
         conn.commit()
 
 def is_user_registered(user_id: int) -> bool:
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         cur = conn.cursor()
         cur.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
         return cur.fetchone() is not None
 
+def get_registered_user_ids() -> list[int]:
+    with _connect() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT user_id FROM users")
+        return [row[0] for row in cur.fetchall()]
+
 def insert_faq_question(question: str):
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         cur = conn.cursor()
-        cur.execute("INSERT INTO unanswered_questions (question) VALUES (?)", (question,))
+        _insert_unanswered(cur, [question])
         conn.commit()
 
 def get_faq_answer(question: str) -> str:
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         cur = conn.cursor()
         cur.execute("SELECT answer FROM faq WHERE question = ?", (question,))
         row = cur.fetchone()
         return row[0] if row else "Ответ пока не найден"
 
-def create_user_questions_table(user_identifier: str) -> str:
-    """Создаёт отдельную таблицу для вопросов пользователя"""
-    table_name = f"user_questions_{user_identifier}"
-    with sqlite3.connect(DB_PATH) as conn:
+# ==========================
+# Вопросы пользователей (одна таблица user_questions)
+# ==========================
+# Раньше у каждого пользователя была своя таблица user_questions_<id> (имя в users.questions_table).
+# migrate_user_questions переносит их в общую таблицу порциями: таблица пользователя копируется,
+# удаляется и отвязывается в одной транзакции, поэтому читатель видит её вопросы либо в старой
+# таблице, либо в новой. Пока перенос не закончен, функции ниже учитывают оставшиеся таблицы.
+# Таблицы ищутся и по users.questions_table, и по имени в sqlite_master: старая регистрация
+# (INSERT OR REPLACE) обнуляла questions_table, оставляя таблицу без ссылки.
+# Номера строк старой таблицы и user_questions независимы, поэтому строки старой таблицы помечены (legacy).
+USER_QUESTIONS_MIGRATION_ROWS = 5000    # Сколько строк переносить за одну транзакцию
+LEGACY_QUESTIONS_PREFIX = "user_questions_"
+
+
+def _legacy_questions_tables(cur: sqlite3.Cursor) -> list[tuple[int, str]]:
+    """Ещё не перенесённые личные таблицы: [(user_id, имя таблицы), ...]"""
+    cur.execute("SELECT user_id, questions_table FROM users WHERE questions_table IS NOT NULL")
+    tables = dict(cur.fetchall())
+    cur.execute(r"SELECT name FROM sqlite_master WHERE type = 'table' "
+                r"AND name LIKE 'user\_questions\_%' ESCAPE '\'")
+    known = set(tables.values())
+    for (name,) in cur.fetchall():
+        suffix = name[len(LEGACY_QUESTIONS_PREFIX):]
+        if name not in known and suffix.isdigit():
+            tables.setdefault(int(suffix), name)
+    return sorted(tables.items())
+
+
+def _legacy_questions_table(cur: sqlite3.Cursor, user_id: int) -> str | None:
+    """Старая личная таблица пользователя, если она ещё не перенесена"""
+    cur.execute("SELECT questions_table FROM users WHERE user_id = ?", (user_id,))
+    row = cur.fetchone()
+    if row and row[0]:
+        return row[0]
+    name = f"{LEGACY_QUESTIONS_PREFIX}{user_id}"
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return name if cur.fetchone() else None
+
+
+def _migrate_questions_table(cur: sqlite3.Cursor, user_id: int, table_name: str) -> int:
+    """Переносит личную таблицу пользователя в user_questions и удаляет её; возвращает число строк"""
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+    moved = 0
+    if cur.fetchone():
+        cur.execute(f"INSERT INTO user_questions (user_id, question, answer, status, timestamp) "
+                    f"SELECT ?, question, answer, status, timestamp FROM {table_name} ORDER BY id",
+                    (user_id,))
+        moved = cur.rowcount
+        cur.execute(f"DROP TABLE {table_name}")
+    cur.execute("UPDATE users SET questions_table = NULL WHERE user_id = ?", (user_id,))
+    return moved
+
+
+def migrate_user_questions(batch_rows: int = USER_QUESTIONS_MIGRATION_ROWS) -> tuple[int, int]:
+    """
+    Одна порция переноса: личные таблицы, пока не набралось batch_rows строк (минимум одна таблица).
+    Возвращает (перенесено строк, осталось таблиц).
+    """
+    with _connect() as conn:
         cur = conn.cursor()
-        cur.execute(f'''CREATE TABLE IF NOT EXISTS {table_name} (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            question TEXT,
-                            answer TEXT,
-                            status TEXT CHECK(status IN ('green','yellow','red')) DEFAULT 'yellow',
-                            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                        )''')
+        pending = _legacy_questions_tables(cur)
+        moved = done = 0
+        for user_id, table_name in pending:
+            if done and moved >= batch_rows:
+                break
+            moved += _migrate_questions_table(cur, user_id, table_name)
+            done += 1
         conn.commit()
-    return table_name
+        return moved, len(pending) - done
 
 
 def add_user_question(user_id: int, question: str, answer: str | None = None, status: str = "yellow"):
-    """Добавляем вопрос в личную таблицу пользователя"""
-    with sqlite3.connect(DB_PATH) as conn:
+    """Добавляет вопрос в список пользователя"""
+    with _connect() as conn:
         cur = conn.cursor()
-        # получаем имя таблицы
-        cur.execute("SELECT questions_table FROM users WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        if not row or not row[0]:
-            identifier = str(user_id)
-            table_name = create_user_questions_table(identifier)
-            cur.execute("UPDATE users SET questions_table = ? WHERE user_id = ?", (table_name, user_id))
-        else:
-            table_name = row[0]
-
-        cur.execute(f"INSERT INTO {table_name} (question, answer, status) VALUES (?, ?, ?)",
-                    (question, answer, status))
+        cur.execute("INSERT INTO user_questions (user_id, question, answer, status) VALUES (?, ?, ?, ?)",
+                    (user_id, question, answer, status))
         conn.commit()
 
 
 def get_user_questions(user_id: int):
-    """Возвращает все вопросы пользователя с цветом статуса"""
-    with sqlite3.connect(DB_PATH) as conn:
+    """
+    Возвращает все вопросы пользователя с цветом статуса: [(id, вопрос, ответ, статус, legacy), ...];
+    legacy — строка ещё не перенесённой личной таблицы (её id не из user_questions)
+    """
+    with _connect() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT questions_table FROM users WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        if not row or not row[0]:
-            return []
-        table_name = row[0]
-        cur.execute(f"SELECT id, question, answer, status FROM {table_name}")
-        return cur.fetchall()
-
-
-def delete_user_question(user_id: int, question_id: int):
-    """Удаляет вопрос только из таблицы пользователя"""
-    with sqlite3.connect(DB_PATH) as conn:
+        rows = []
+        legacy = _legacy_questions_table(cur, user_id)
+        if legacy:
+            cur.execute(f"SELECT id, question, answer, status, 1 FROM {legacy} ORDER BY id")
+            rows = cur.fetchall()
+        cur.execute("SELECT id, question, answer, status, 0 FROM user_questions WHERE user_id = ? ORDER BY id",
+                    (user_id,))
+        return [(q_id, q, a, s, bool(old)) for q_id, q, a, s, old in rows + cur.fetchall()]
+
+
+def delete_user_question(user_id: int, question_id: int, legacy: bool = False):
+    """Удаляет вопрос только из списка этого пользователя; legacy — id из ещё не перенесённой личной таблицы"""
+    with _connect() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT questions_table FROM users WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        if not row or not row[0]:
-            return False
-        table_name = row[0]
-        cur.execute(f"DELETE FROM {table_name} WHERE id = ?", (question_id,))
+        if legacy:
+            table_name = _legacy_questions_table(cur, user_id)
+            if not table_name:
+                return False    # таблицу уже перенесли — номера строк изменились
+            cur.execute(f"DELETE FROM {table_name} WHERE id = ?", (question_id,))
+        else:
+            cur.execute("DELETE FROM user_questions WHERE id = ? AND user_id = ?", (question_id, user_id))
+        deleted = cur.rowcount > 0
         conn.commit()
-        return True
+        return deleted
@@ -0,0 +1,94 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from . import database
+
+# ==========================
+# Асинхронный доступ к БД
+# ==========================
+# Те же функции, что в database, но awaitable: запрос выполняется в выделенном потоке
+# с его долгоживущим подключением (database._connect), event loop на диске не блокируется.
+# Записи идут через один поток — SQLite всё равно пишет по одному, а так транзакции не спорят
+# за блокировку; чтения — через небольшой пул, в режиме WAL они идут параллельно с записью.
+
+DB_READ_THREADS = 2
+
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+_read_executor = ThreadPoolExecutor(max_workers=DB_READ_THREADS, thread_name_prefix="db-read")
+
+
+def _run_in(executor: ThreadPoolExecutor, fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+    return wrapper
+
+
+def _read(fn):
+    return _run_in(_read_executor, fn)
+
+
+def _write(fn):
+    return _run_in(_write_executor, fn)
+
+
+# Чтение
+get_question_by_hash = _read(database.get_question_by_hash)
+get_faq_version = _read(database.get_faq_version)
+get_all_faq_questions = _read(database.get_all_faq_questions)
+get_all_faq_entries = _read(database.get_all_faq_entries)
+count_answered_faq = _read(database.count_answered_faq)
+get_faq_answers = _read(database.get_faq_answers)
+get_faq_answer = _read(database.get_faq_answer)
+get_faq_answers_by_hash = _read(database.get_faq_answers_by_hash)
+get_faq_answer_by_hash = _read(database.get_faq_answer_by_hash)
+get_backlog_tables = _read(database.get_backlog_tables)
+get_backlog_page = _read(database.get_backlog_page)
+get_unanswered_for_clustering = _read(database.get_unanswered_for_clustering)
+get_operator_queue = _read(database.get_operator_queue)
+is_user_registered = _read(database.is_user_registered)
+get_registered_user_ids = _read(database.get_registered_user_ids)
+get_meta_value = _read(database.get_meta_value)
+get_user_questions = _read(database.get_user_questions)
+
+# Запись
+init_db = _write(database.init_db)
+merge_faq_from_excel = _write(database.merge_faq_from_excel)
+mark_backlog_answered = _write(database.mark_backlog_answered)
+log_unanswered_question = _write(database.log_unanswered_question)
+write_question_batch = _write(database.write_question_batch)
+set_meta_value = _write(database.set_meta_value)
+save_question_clusters = _write(database.save_question_clusters)
+insert_user = _write(database.insert_user)
+insert_faq_question = _write(database.insert_faq_question)
+migrate_user_questions = _write(database.migrate_user_questions)
+add_user_question = _write(database.add_user_question)
+delete_user_question = _write(database.delete_user_question)
+
+
+async def run_user_questions_migration():
+    """Переносит личные таблицы вопросов в user_questions порциями; между порциями проходят другие записи"""
+    moved_total = 0
+    try:
+        while True:
+            moved, remaining = await migrate_user_questions()
+            moved_total += moved
+            if not remaining:
+                break
+            logging.info(f"[DB] Перенос вопросов пользователей: перенесено {moved_total}, осталось таблиц {remaining}")
+    except Exception as e:
+        logging.error(f"[DB] Ошибка переноса вопросов пользователей: {e}")
+        return
+    if moved_total:
+        logging.info(f"[DB] Вопросы пользователей перенесены в user_questions: {moved_total}")
+
+
+def shutdown():
+    """Дожидается начатых запросов и закрывает подключения"""
+    for executor in (_write_executor, _read_executor):
+        executor.shutdown(wait=True)
+    database.close_connections()
+    logging.info("[DB] Подключения закрыты")
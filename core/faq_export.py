@@ -0,0 +1,86 @@
+import asyncio
+import csv
+import logging
+import os
+import time
+
+from aiogram.types import FSInputFile, Message
+from openpyxl import Workbook
+
+from . import db_async
+from .database import DB_PATH, iter_answered_faq
+
+# ==========================
+# Выгрузка FAQ файлом
+# ==========================
+# Файл пишется потоково (openpyxl write_only или csv) порциями прямо из курсора SQLite в отдельном
+# потоке, event loop не блокируется. Готовый файл лежит в FAQ_EXPORT_DIR и помечен версией FAQ;
+# file_id, который Telegram вернул после первой отправки, хранится в meta — повторные выгрузки
+# той же версии уходят по file_id, без генерации и повторной загрузки файла.
+
+FAQ_EXPORT_FORMAT = "xlsx"      # xlsx или csv
+FAQ_EXPORT_CHUNK = 1000         # Строк, читаемых из курсора за раз
+FAQ_EXPORT_DIR = os.path.join(os.path.dirname(DB_PATH), 'faq_export')
+
+_export_lock = asyncio.Lock()
+
+
+def _export_path(version: int, fmt: str) -> str:
+    return os.path.join(FAQ_EXPORT_DIR, f"faq_v{version}.{fmt}")
+
+
+def write_faq_export(path: str, fmt: str = FAQ_EXPORT_FORMAT) -> int:
+    """Пишет вопросы FAQ с ответом в файл (колонки question, answer — как у импорта); возвращает число строк"""
+    rows_written = 0
+    tmp_path = path + ".tmp"
+    if fmt == "csv":
+        with open(tmp_path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(("question", "answer"))
+            for chunk in iter_answered_faq(FAQ_EXPORT_CHUNK):
+                writer.writerows(chunk)
+                rows_written += len(chunk)
+    else:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("FAQ")
+        sheet.append(("question", "answer"))
+        for chunk in iter_answered_faq(FAQ_EXPORT_CHUNK):
+            for row in chunk:
+                sheet.append(row)
+            rows_written += len(chunk)
+        workbook.save(tmp_path)
+    os.replace(tmp_path, path)
+    return rows_written
+
+
+def _build_export(version: int, fmt: str) -> str:
+    """Файл выгрузки для версии FAQ (строится, если его ещё нет); файлы прошлых версий удаляются"""
+    os.makedirs(FAQ_EXPORT_DIR, exist_ok=True)
+    path = _export_path(version, fmt)
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        rows = write_faq_export(path, fmt)
+        logging.info(f"[FaqExport] Выгрузка версии {version}: {rows} строк за {time.perf_counter() - started:.2f} с")
+    for name in os.listdir(FAQ_EXPORT_DIR):
+        if not name.startswith(f"faq_v{version}."):
+            try:
+                os.remove(os.path.join(FAQ_EXPORT_DIR, name))
+            except OSError:
+                pass
+    return path
+
+
+async def send_faq_export(message: Message, fmt: str = FAQ_EXPORT_FORMAT):
+    """Отправляет выгрузку FAQ в чат сообщения: по сохранённому file_id или, для новой версии, файлом"""
+    async with _export_lock:
+        version = await db_async.get_faq_version()
+        meta_key = f"faq_export_file_id:{fmt}"
+        cached = await db_async.get_meta_value(meta_key)
+        if cached:
+            cached_version, _, file_id = cached.partition(":")
+            if cached_version == str(version):
+                await message.answer_document(file_id)
+                return
+        path = await asyncio.to_thread(_build_export, version, fmt)
+        sent = await message.answer_document(FSInputFile(path, filename=f"faq_v{version}.{fmt}"))
+        await db_async.set_meta_value(meta_key, f"{version}:{sent.document.file_id}")
@@ -0,0 +1,655 @@
+import os
+import re
+import copy
+import json
+import time
+import shutil
+import logging
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+from .ann_index import IVFIndex
+from .bktree import EditDistanceIndex
+
+# ==========================
+# TF-IDF индекс FAQ с инкрементальными изменениями
+# ==========================
+# Индекс = неизменяемая база + дельта.
+# База обучается целиком (fit) и хранится на диске: CSR-матрица сырых частот термов
+# (data/indices/indptr в .npy, читаются через mmap), счётчики документов df, LSA и IVF.
+# Дельта — добавленные после обучения строки (дописываются в конец, номера строк не сдвигаются)
+# и «надгробия» удалённых строк (маска alive). Изменение строки = удаление + добавление.
+# idf не хранится, а считается из текущих df и числа живых строк, поэтому TF-IDF оценки
+# после дельты те же, что после полного переобучения.
+# Снимок (FaqIndex) не меняется: apply_delta возвращает новый снимок, а запрос, уже взявший
+# ссылку на старый, дорабатывает на нём. Когда дельта разрастается, база переобучается заново (компактизация).
+# Дельты пишутся в журнал delta.jsonl рядом с базой — по нему догоняют индекс процессы поиска.
+
+TOKEN_PATTERN = r"(?u)\b\w\w+\b"   # тот же шаблон, что у TfidfVectorizer по умолчанию
+_TOKEN_RE = re.compile(TOKEN_PATTERN)
+
+CURRENT_FILE = "CURRENT"          # имя каталога актуальной базы; пишется последним при сохранении
+DELTA_LOG_FILE = "delta.jsonl"
+_META_FILE = "meta.json"
+_ARRAY_FILES = ("data", "indices", "indptr", "df")
+_LSA_FILES = ("lsa_components", "lsa_vectors", "lsa_idf")
+
+# Строка FAQ: (faq.id, вопрос, нормализованная форма tokens, question_hash)
+FaqEntry = tuple[int | None, str, str, str]
+
+
+def char_trigrams(text: str) -> set[str]:
+    """Символьные триграммы строки (с пробелами по краям, как у pg_trgm)"""
+    padded = f" {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _build_postings(keys_per_doc) -> dict[str, np.ndarray]:
+    """Обратный индекс: ключ -> отсортированный массив номеров вопросов"""
+    postings: dict[str, list[int]] = {}
+    for doc, keys in enumerate(keys_per_doc):
+        for key in keys:
+            postings.setdefault(key, []).append(doc)
+    return {key: np.array(docs, dtype=np.int32) for key, docs in postings.items()}
+
+
+def smooth_idf(df: np.ndarray, n_docs: int) -> np.ndarray:
+    """idf как у TfidfVectorizer(smooth_idf=True); у термов без живых строк — 0 (их словарь переобучения не знал бы)"""
+    idf = (np.log((1 + n_docs) / (1 + df.astype(np.float64))) + 1).astype(np.float32)
+    idf[df <= 0] = 0
+    return idf
+
+
+class _Base:
+    """Обученная часть индекса: строки 0..size-1. Общая для всех снимков, после построения не меняется"""
+
+    def __init__(self, size: int, tf: sparse.csr_matrix):
+        self.size = size
+        self.tf = tf    # сырые частоты термов (строки x словарь на момент обучения)
+        # LSA: компоненты (k x словарь), L2-нормированные векторы строк (строки x k) и idf, с которым они обучены
+        self.lsa_components: np.ndarray | None = None
+        self.lsa_vectors: np.ndarray | None = None
+        self.lsa_idf: np.ndarray | None = None
+        # Приближённый поиск по lsa_vectors для больших баз (None — точный перебор)
+        self.ann: IVFIndex | None = None
+        # Строятся при первом запросе
+        self.token_postings: dict[str, np.ndarray] | None = None
+        self.trigram_postings: dict[str, np.ndarray] | None = None
+        self.edit_index: EditDistanceIndex | None = None
+        self.fuzzy_questions: list[str] | None = None
+
+
+class FaqIndex:
+    """Снимок индекса FAQ: база + добавленные строки + маска удалённых"""
+
+    def __init__(self, base: _Base, entries: list[FaqEntry], vocabulary: dict[str, int], df: np.ndarray,
+                 generation: int = 0):
+        self.base = base
+        self.ids = [e[0] for e in entries]
+        self.questions = [e[1] for e in entries]
+        self.tokens = [e[2] for e in entries]
+        self.hashes = [e[3] for e in entries]
+        # Множества стемов вопросов для пословных методов (subword, jaccard)
+        self.token_sets = [frozenset(t.split()) for t in self.tokens]
+        # faq.id -> номер строки; точное совпадение: question_hash / нормализованная форма -> номер строки
+        self.id_positions = {faq_id: i for i, faq_id in enumerate(self.ids) if faq_id is not None}
+        self.hash_positions = {h: i for i, h in enumerate(self.hashes)}
+        self.tokens_positions = {t: i for i, t in enumerate(self.tokens) if t}
+        self.vocabulary = vocabulary
+        self.df = df                                   # число живых строк с термом
+        self.alive = np.ones(len(entries), dtype=bool)
+        self.n_live = len(entries)
+        # Дельта: частоты термов добавленных строк (номер колонки -> частота), их LSA-векторы
+        # и обратные индексы по ним (ключ -> кортеж номеров строк)
+        self.delta_rows: list[dict[int, int]] = []
+        self.delta_lsa: np.ndarray | None = None
+        self.delta_token_postings: dict[str, tuple[int, ...]] = {}
+        self.delta_trigram_postings: dict[str, tuple[int, ...]] = {}
+        self.ann = base.ann
+        self.generation = generation                   # номер последней применённой дельты
+        self._reset_caches()
+
+    def _reset_caches(self):
+        # Зависят от df и набора строк, поэтому у каждого снимка свои
+        self._idf: np.ndarray | None = None
+        self._norms: tuple[np.ndarray, np.ndarray] | None = None
+        self._delta_tf: sparse.csr_matrix | None = None
+        self._fuzzy_questions: list[str] | None = None
+        self._delta_lower: list[str] | None = None
+        self._live_questions: list[str] | None = None
+
+    def __len__(self):
+        return len(self.questions)
+
+    @classmethod
+    def fit(cls, entries: list[FaqEntry], generation: int = 0) -> "FaqIndex":
+        """Обучает базу по строкам FAQ с уже посчитанными tokens и question_hash"""
+        counter = CountVectorizer(token_pattern=TOKEN_PATTERN, dtype=np.float32)
+        try:
+            tf = counter.fit_transform([e[2] for e in entries])
+            vocabulary = {term: int(col) for term, col in counter.vocabulary_.items()}
+        except ValueError:
+            # Пустой словарь (все вопросы состоят из стоп-слов) — индекс без признаков
+            tf = sparse.csr_matrix((len(entries), 0), dtype=np.float32)
+            vocabulary = {}
+        tf = sparse.csr_matrix(tf, dtype=np.float32)
+        tf.sort_indices()
+        df = np.bincount(tf.indices, minlength=len(vocabulary)).astype(np.int32)
+        return cls(_Base(len(entries), tf), list(entries), vocabulary, df, generation)
+
+    # ==========================
+    # TF-IDF
+    # ==========================
+    @property
+    def idf(self) -> np.ndarray:
+        if self._idf is None:
+            self._idf = smooth_idf(self.df, self.n_live)
+        return self._idf
+
+    def _delta_matrix(self) -> sparse.csr_matrix:
+        if self._delta_tf is None:
+            indptr = np.zeros(len(self.delta_rows) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(row) for row in self.delta_rows])
+            indices = np.fromiter((c for row in self.delta_rows for c in row), dtype=np.int32, count=indptr[-1])
+            data = np.fromiter((v for row in self.delta_rows for v in row.values()), dtype=np.float32,
+                               count=indptr[-1])
+            self._delta_tf = sparse.csr_matrix((data, indices, indptr),
+                                               shape=(len(self.delta_rows), len(self.vocabulary)))
+        return self._delta_tf
+
+    def _row_norms(self) -> tuple[np.ndarray, np.ndarray]:
+        """L2-нормы TF-IDF векторов строк базы и дельты при текущем idf"""
+        if self._norms is None:
+            idf2 = self.idf.astype(np.float64) ** 2
+            tf, delta = self.base.tf, self._delta_matrix()
+            self._norms = (
+                np.sqrt(tf.power(2) @ idf2[:tf.shape[1]]).astype(np.float32),
+                np.sqrt(delta.power(2) @ idf2).astype(np.float32),
+            )
+        return self._norms
+
+    def _query_terms(self, processed_text: str) -> tuple[np.ndarray, np.ndarray]:
+        """Колонки словаря и частоты термов запроса"""
+        counts = Counter(
+            self.vocabulary[t] for t in _TOKEN_RE.findall(processed_text.lower()) if t in self.vocabulary
+        )
+        return (np.fromiter(counts.keys(), dtype=np.int64, count=len(counts)),
+                np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+
+    def _query_weights(self, processed_text: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Колонки и веса запроса: нормированный TF-IDF вектор, умноженный ещё раз на idf.
+        cos = sum(q_t * tf_dt * idf_t) / |d| — idf строки переносим в вектор запроса, матрица хранит сырые частоты.
+        """
+        cols, counts = self._query_terms(processed_text)
+        idf = self.idf
+        weights = counts * idf[cols]
+        norm = np.linalg.norm(weights)
+        if norm == 0:
+            return cols[:0], weights[:0]
+        return cols, weights / norm * idf[cols]
+
+    def tfidf_scores(self, processed_text: str) -> np.ndarray:
+        """Косинусная схожесть запроса со всеми строками (как TfidfVectorizer + cosine_similarity)"""
+        scores = np.zeros(len(self), dtype=np.float32)
+        cols, weights = self._query_weights(processed_text)
+        if not len(cols):
+            return scores
+        query = np.zeros(len(self.vocabulary), dtype=np.float32)
+        query[cols] = weights
+        base_norms, delta_norms = self._row_norms()
+        size = self.base.size
+        if size:
+            raw = self.base.tf @ query[:self.base.tf.shape[1]]
+            np.divide(raw, base_norms, out=scores[:size], where=base_norms > 0)
+        if self.delta_rows:
+            raw = self._delta_matrix() @ query
+            np.divide(raw, delta_norms, out=scores[size:], where=delta_norms > 0)
+        return scores
+
+    def tfidf_scores_batch(self, processed_texts: list[str]) -> np.ndarray:
+        """Косинусная схожесть пакета запросов со всеми строками: матрица (запросы x строки), одно умножение"""
+        scores = np.zeros((len(processed_texts), len(self)), dtype=np.float32)
+        rows, cols, values = [], [], []
+        for i, text in enumerate(processed_texts):
+            query_cols, weights = self._query_weights(text)
+            rows.append(np.full(len(query_cols), i))
+            cols.append(query_cols)
+            values.append(weights)
+        if not sum(len(c) for c in cols):
+            return scores
+        queries = sparse.csr_matrix(
+            (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(len(processed_texts), len(self.vocabulary)), dtype=np.float32,
+        )
+        base_norms, delta_norms = self._row_norms()
+        size = self.base.size
+        if size:
+            # (строки x словарь) @ (словарь x запросы): транспонируется только маленькая матрица запросов
+            raw = (self.base.tf @ queries[:, :self.base.tf.shape[1]].T).T.toarray()
+            np.divide(raw, base_norms, out=scores[:, :size], where=base_norms > 0)
+        if self.delta_rows:
+            raw = (self._delta_matrix() @ queries.T).T.toarray()
+            np.divide(raw, delta_norms, out=scores[:, size:], where=delta_norms > 0)
+        return scores
+
+    # ==========================
+    # Семантический поиск (LSA)
+    # ==========================
+    def fit_lsa(self, n_components: int):
+        """TruncatedSVD над TF-IDF матрицей базы; пропускается, если признаков слишком мало"""
+        tf = self.base.tf
+        n_components = min(n_components, tf.shape[1] - 1, tf.shape[0] - 1)
+        if n_components < 2:
+            self.base.lsa_components = self.base.lsa_vectors = self.base.lsa_idf = None
+            return
+        idf = self.idf[:tf.shape[1]].copy()
+        svd = TruncatedSVD(n_components=n_components, random_state=0)
+        vectors = svd.fit_transform(normalize(tf @ sparse.diags(idf))).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.base.lsa_vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+        self.base.lsa_components = svd.components_.astype(np.float32)
+        self.base.lsa_idf = idf
+
+    def build_ann(self, nlist: int):
+        """Строит IVF-индекс над LSA-векторами базы"""
+        if self.base.lsa_vectors is None:
+            self.base.ann = self.ann = None
+            return
+        self.base.ann = self.ann = IVFIndex.train(self.base.lsa_vectors, nlist)
+        logging.info(f"[FaqIndex] IVF-индекс: {self.ann.nlist} списков, {len(self.ann)} векторов")
+
+    def _lsa_vector(self, cols: np.ndarray, counts: np.ndarray) -> np.ndarray | None:
+        """Проекция текста в пространство LSA (термы, появившиеся после обучения, не учитываются)"""
+        components = self.base.lsa_components
+        keep = cols < components.shape[1]
+        cols, counts = cols[keep], counts[keep]
+        weights = counts * self.base.lsa_idf[cols]
+        if not np.any(weights):
+            return None
+        vector = components[:, cols] @ weights
+        norm = np.linalg.norm(vector)
+        return (vector / norm).astype(np.float32) if norm > 0 else None
+
+    def semantic_scores(self, processed_text: str, top_k: int, nprobe: int = 8, block_size: int = 65536):
+        """
+        top_k ближайших живых строк в пространстве LSA: (номера строк, косинусная схожесть).
+        С IVF-индексом сканируются только nprobe ближайших списков; без него векторы базы
+        перемножаются блоками, чтобы отображённый в память файл читался последовательно.
+        """
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if self.base.lsa_vectors is None:
+            return empty
+        vector = self._lsa_vector(*self._query_terms(processed_text))
+        if vector is None:
+            return empty
+        # Удалённые строки отбрасываются после поиска, поэтому берём с запасом
+        want = top_k + (len(self) - self.n_live)
+        if self.ann is not None:
+            best_pos, best_scores = self.ann.search(vector, want, nprobe)
+        else:
+            best_pos, best_scores = empty
+            vectors = [self.base.lsa_vectors]
+            if self.delta_lsa is not None:
+                vectors.append(self.delta_lsa)
+            start = 0
+            for part_vectors in vectors:
+                for offset in range(0, part_vectors.shape[0], block_size):
+                    scores = part_vectors[offset:offset + block_size] @ vector
+                    if len(scores) > want:
+                        part = np.argpartition(-scores, want - 1)[:want]
+                    else:
+                        part = np.arange(len(scores))
+                    best_pos = np.concatenate([best_pos, part + start + offset])
+                    best_scores = np.concatenate([best_scores, scores[part]])
+                    if len(best_scores) > want:
+                        keep = np.argpartition(-best_scores, want - 1)[:want]
+                        best_pos, best_scores = best_pos[keep], best_scores[keep]
+                start += part_vectors.shape[0]
+        live = self.alive[best_pos]
+        best_pos, best_scores = best_pos[live], best_scores[live]
+        if len(best_scores) > top_k:
+            keep = np.argpartition(-best_scores, top_k - 1)[:top_k]
+            best_pos, best_scores = best_pos[keep], best_scores[keep]
+        return best_pos, best_scores
+
+    # ==========================
+    # Точное совпадение, кандидаты, символьные методы
+    # ==========================
+    def exact_match(self, question_hash: str, processed_text: str) -> int | None:
+        """Номер вопроса, совпадающего с запросом по question_hash или по нормализованной форме"""
+        pos = self.hash_positions.get(question_hash)
+        if pos is None and processed_text:
+            pos = self.tokens_positions.get(processed_text)
+        return pos
+
+    # Обратные индексы и BK-деревья базы строятся при первом обращении (или заранее — warm)
+    def _base_token_postings(self) -> dict[str, np.ndarray]:
+        if self.base.token_postings is None:
+            self.base.token_postings = _build_postings(self.token_sets[:self.base.size])
+        return self.base.token_postings
+
+    def _base_trigram_postings(self) -> dict[str, np.ndarray]:
+        if self.base.trigram_postings is None:
+            self.base.trigram_postings = _build_postings(char_trigrams(q) for q in self.questions[:self.base.size])
+        return self.base.trigram_postings
+
+    def _base_edit_index(self) -> EditDistanceIndex:
+        if self.base.edit_index is None:
+            self.base.edit_index = EditDistanceIndex([q.lower() for q in self.questions[:self.base.size]])
+        return self.base.edit_index
+
+    def warm(self, processor):
+        """
+        Строит заранее всё, что иначе строилось бы на первом запросе: обратные индексы по стемам
+        и триграммам, BK-деревья, нормализованные для Fuzzy вопросы (processor), нормы строк TF-IDF
+        """
+        self._base_token_postings()
+        self._base_trigram_postings()
+        self._base_edit_index()
+        self.fuzzy_questions(processor)
+        self._row_norms()
+
+    def _token_lists(self, query_tokens: set[str]) -> list:
+        token_postings = self._base_token_postings()
+        lists = [token_postings[t] for t in query_tokens if t in token_postings]
+        lists.extend(self.delta_token_postings[t] for t in query_tokens if t in self.delta_token_postings)
+        return lists
+
+    @staticmethod
+    def _count_hits(lists: list, size: int) -> np.ndarray:
+        if not lists:
+            return np.zeros(size, dtype=np.int32)
+        return np.bincount(np.concatenate([np.asarray(docs, dtype=np.int32) for docs in lists]),
+                           minlength=size).astype(np.int32)
+
+    def token_overlap(self, query_tokens: set[str]) -> np.ndarray:
+        """Число общих стемов запроса с каждым вопросом (по обратному индексу, без перебора FAQ)"""
+        return self._count_hits(self._token_lists(query_tokens), len(self))
+
+    def candidates(self, query_tokens: set[str], query_text: str | None = None,
+                   limit: int | None = None, max_df: float = 0.2) -> np.ndarray:
+        """
+        Номера живых вопросов, у которых есть общий стем (и, если передан query_text, общая триграмма) с запросом.
+        Триграммы, встречающиеся больше чем в max_df доле вопросов, не учитываются.
+        Если кандидатов больше limit — оставляет limit вопросов с наибольшим числом совпадений.
+        """
+        lists = self._token_lists(query_tokens)
+        if query_text is not None:
+            trigram_postings = self._base_trigram_postings()
+            max_docs = max_df * len(self)
+            for gram in char_trigrams(query_text):
+                docs = [d for d in (trigram_postings.get(gram), self.delta_trigram_postings.get(gram))
+                        if d is not None]
+                if docs and sum(len(d) for d in docs) <= max_docs:
+                    lists.extend(docs)
+        hits = self._count_hits(lists, len(self))
+        hits[~self.alive] = 0
+        found = np.flatnonzero(hits)
+        if limit is not None and len(found) > limit:
+            found = np.sort(found[np.argpartition(-hits[found], limit - 1)[:limit]])
+        return found.astype(np.int32)
+
+    def fuzzy_questions(self, processor) -> list[str]:
+        """Вопросы, нормализованные processor (для Fuzzy); считаются один раз на снимок"""
+        if self._fuzzy_questions is None:
+            if self.base.fuzzy_questions is None:
+                self.base.fuzzy_questions = [processor(q) for q in self.questions[:self.base.size]]
+            self._fuzzy_questions = self.base.fuzzy_questions + [
+                processor(q) for q in self.questions[self.base.size:]
+            ]
+        return self._fuzzy_questions
+
+    def edit_search(self, query: str, max_dist: int) -> list[tuple[int, int]]:
+        """Живые вопросы (в нижнем регистре) на расстоянии Левенштейна <= max_dist: [(номер, расстояние), ...]"""
+        found = self._base_edit_index().search(query, max_dist)
+        if self.delta_rows:
+            # Добавленных строк мало до компактизации — считаем их пакетно без дерева
+            if self._delta_lower is None:
+                self._delta_lower = [q.lower() for q in self.questions[self.base.size:]]
+            dists = process.cdist([query], self._delta_lower, scorer=Levenshtein.distance,
+                                  score_cutoff=max_dist, workers=-1)[0]
+            found.extend((self.base.size + int(j), int(dists[j])) for j in np.flatnonzero(dists <= max_dist))
+        return [(i, dist) for i, dist in found if self.alive[i]]
+
+    # ==========================
+    # Инкрементальные изменения
+    # ==========================
+    @property
+    def delta_size(self) -> int:
+        """Сколько строк добавлено и удалено с момента обучения базы"""
+        return len(self.delta_rows) + (len(self) - self.n_live)
+
+    @property
+    def live_questions(self) -> list[str]:
+        if self._live_questions is None:
+            self._live_questions = [q for q, alive in zip(self.questions, self.alive) if alive]
+        return self._live_questions
+
+    def live_entries(self) -> list[FaqEntry]:
+        """Живые строки в порядке номеров (для переобучения базы)"""
+        return [(self.ids[i], self.questions[i], self.tokens[i], self.hashes[i])
+                for i in np.flatnonzero(self.alive)]
+
+    def _row_columns(self, pos: int):
+        if pos < self.base.size:
+            tf = self.base.tf
+            return tf.indices[tf.indptr[pos]:tf.indptr[pos + 1]]
+        return list(self.delta_rows[pos - self.base.size])
+
+    def apply_delta(self, added: list[FaqEntry], deleted: list[int]) -> "FaqIndex":
+        """
+        Новый снимок с изменениями; текущий не меняется.
+        added — новые и изменённые строки (строка с уже известным faq.id заменяет прежнюю), deleted — faq.id.
+        """
+        new = copy.copy(self)
+        new._reset_caches()
+        for name in ("ids", "questions", "tokens", "hashes", "token_sets", "delta_rows"):
+            setattr(new, name, list(getattr(self, name)))
+        for name in ("id_positions", "hash_positions", "tokens_positions", "vocabulary",
+                     "delta_token_postings", "delta_trigram_postings"):
+            setattr(new, name, dict(getattr(self, name)))
+        new.alive = np.concatenate([self.alive, np.ones(len(added), dtype=bool)])
+        df_changes: Counter = Counter()
+
+        def remove(faq_id):
+            pos = new.id_positions.pop(faq_id, None)
+            if pos is None or not new.alive[pos]:
+                return
+            new.alive[pos] = False
+            new.n_live -= 1
+            df_changes.update({int(c): -1 for c in new._row_columns(pos)})
+            if new.hash_positions.get(new.hashes[pos]) == pos:
+                del new.hash_positions[new.hashes[pos]]
+            if new.tokens_positions.get(new.tokens[pos]) == pos:
+                del new.tokens_positions[new.tokens[pos]]
+
+        for faq_id in deleted:
+            remove(faq_id)
+        new_rows = []
+        for faq_id, question, tokens, question_hash in added:
+            if faq_id is not None:
+                remove(faq_id)
+            pos = len(new.questions)
+            row: Counter = Counter()
+            for term in _TOKEN_RE.findall(tokens.lower()):
+                col = new.vocabulary.get(term)
+                if col is None:
+                    col = new.vocabulary[term] = len(new.vocabulary)
+                row[col] += 1
+            df_changes.update(dict.fromkeys(row, 1))
+            new_rows.append(row)
+            new.delta_rows.append(dict(row))
+            new.ids.append(faq_id)
+            new.questions.append(question)
+            new.tokens.append(tokens)
+            new.hashes.append(question_hash)
+            new.token_sets.append(frozenset(tokens.split()))
+            new.n_live += 1
+            if faq_id is not None:
+                new.id_positions[faq_id] = pos
+            new.hash_positions[question_hash] = pos
+            if tokens:
+                new.tokens_positions[tokens] = pos
+            for term in new.token_sets[-1]:
+                new.delta_token_postings[term] = new.delta_token_postings.get(term, ()) + (pos,)
+            for gram in char_trigrams(question):
+                new.delta_trigram_postings[gram] = new.delta_trigram_postings.get(gram, ()) + (pos,)
+
+        new.df = np.concatenate([self.df, np.zeros(len(new.vocabulary) - len(self.df), dtype=np.int32)])
+        if df_changes:
+            cols = np.fromiter(df_changes.keys(), dtype=np.int64, count=len(df_changes))
+            np.add.at(new.df, cols, np.fromiter(df_changes.values(), dtype=np.int32, count=len(df_changes)))
+
+        if self.base.lsa_vectors is not None and new_rows:
+            vectors = np.zeros((len(new_rows), self.base.lsa_vectors.shape[1]), dtype=np.float32)
+            for j, row in enumerate(new_rows):
+                vector = self._lsa_vector(np.fromiter(row.keys(), dtype=np.int64, count=len(row)),
+                                          np.fromiter(row.values(), dtype=np.float32, count=len(row)))
+                if vector is not None:
+                    vectors[j] = vector
+            new.delta_lsa = vectors if self.delta_lsa is None else np.vstack([self.delta_lsa, vectors])
+            if self.ann is not None:
+                new.ann = self.ann.extended(np.arange(len(self), len(new), dtype=np.int64), vectors)
+        new.generation = self.generation + 1
+        return new
+
+    # ==========================
+    # Хранение на диске
+    # ==========================
+    def save(self, index_dir: str):
+        """
+        Сохраняет базу в новый подкаталог index_dir и переключает на него файл CURRENT.
+        Процессы, уже открывшие прежнюю базу через mmap, дочитывают её до перезагрузки.
+        """
+        if self.delta_size:
+            raise ValueError("Сохраняется только база без дельты: сначала переобучите индекс")
+        os.makedirs(index_dir, exist_ok=True)
+        name = f"base-{time.time_ns()}"
+        base_dir = os.path.join(index_dir, name)
+        os.makedirs(base_dir)
+        arrays = {
+            "data": self.base.tf.data,
+            "indices": self.base.tf.indices,
+            "indptr": self.base.tf.indptr,
+            "df": self.df,
+        }
+        if self.base.lsa_vectors is not None:
+            arrays.update({n: getattr(self.base, n) for n in _LSA_FILES})
+        for array_name, array in arrays.items():
+            np.save(os.path.join(base_dir, f"{array_name}.npy"), np.ascontiguousarray(array))
+        if self.base.ann is not None:
+            self.base.ann.save(base_dir)
+
+        meta = {
+            "shape": list(self.base.tf.shape),
+            "vocabulary": self.vocabulary,
+            "ids": self.ids,
+            "questions": self.questions,
+            "tokens": self.tokens,
+            "hashes": self.hashes,
+            "lsa": self.base.lsa_vectors is not None,
+            "ann": self.base.ann is not None,
+            "generation": self.generation,
+        }
+        with open(os.path.join(base_dir, _META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        current_path = os.path.join(index_dir, CURRENT_FILE)
+        with open(current_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(current_path + ".tmp", current_path)
+        # Прежние базы больше не нужны новым читателям
+        for entry in os.listdir(index_dir):
+            if entry.startswith("base-") and entry != name:
+                shutil.rmtree(os.path.join(index_dir, entry), ignore_errors=True)
+        logging.info(f"[FaqIndex] Индекс сохранён: {base_dir} ({self.base.size} вопросов)")
+
+    @classmethod
+    def load(cls, index_dir: str) -> "FaqIndex | None":
+        """Загружает базу, на которую указывает CURRENT (массивы матрицы отображаются в память); без дельт"""
+        try:
+            with open(os.path.join(index_dir, CURRENT_FILE), encoding="utf-8") as f:
+                base_dir = os.path.join(index_dir, f.read().strip())
+        except FileNotFoundError:
+            return None
+        try:
+            with open(os.path.join(base_dir, _META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+            arrays = {
+                name: np.load(os.path.join(base_dir, f"{name}.npy"), mmap_mode="r")
+                for name in _ARRAY_FILES
+            }
+            tf = sparse.csr_matrix(
+                (arrays["data"], arrays["indices"], arrays["indptr"]),
+                shape=tuple(meta["shape"]),
+                copy=False,
+            )
+            base = _Base(tf.shape[0], tf)
+            if meta["lsa"]:
+                for name in _LSA_FILES:
+                    setattr(base, name, np.load(os.path.join(base_dir, f"{name}.npy"), mmap_mode="r"))
+            if meta["ann"]:
+                base.ann = IVFIndex.load(base_dir)
+            entries = list(zip(meta["ids"], meta["questions"], meta["tokens"], meta["hashes"]))
+            return cls(base, entries, meta["vocabulary"], np.array(arrays["df"]), meta["generation"])
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"[FaqIndex] Не удалось загрузить индекс из {base_dir}: {e}")
+            return None
+
+
+# ==========================
+# Журнал дельт
+# ==========================
+# Строка журнала: {"generation": N, "added": [[id, вопрос, tokens, hash], ...], "deleted": [id, ...]}.
+# Применяются только записи с generation больше, чем у снимка, поэтому повторное чтение безопасно.
+
+def append_delta_log(index_dir: str, generation: int, added: list[FaqEntry], deleted: list[int]):
+    record = {"generation": generation, "added": [list(e) for e in added], "deleted": list(deleted)}
+    with open(os.path.join(index_dir, DELTA_LOG_FILE), "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_delta_log(index_dir: str, offset: int = 0) -> tuple[list[dict], int]:
+    """Записи журнала начиная с байта offset и смещение конца последней полной строки"""
+    try:
+        with open(os.path.join(index_dir, DELTA_LOG_FILE), "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+    records = []
+    end = data.rfind(b"\n") + 1      # недописанную последнюю строку дочитаем в следующий раз
+    for line in data[:end].splitlines():
+        if line.strip():
+            record = json.loads(line)
+            record["added"] = [tuple(e) for e in record["added"]]
+            records.append(record)
+    return records, offset + end
+
+
+def truncate_delta_log(index_dir: str, generation: int):
+    """Убирает из журнала записи, уже вошедшие в базу с номером generation"""
+    records, _ = read_delta_log(index_dir)
+    path = os.path.join(index_dir, DELTA_LOG_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for record in records:
+            if record["generation"] > generation:
+                record["added"] = [list(e) for e in record["added"]]
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def replay_delta_log(index: FaqIndex, records: list[dict]) -> FaqIndex:
+    """Применяет к снимку записи журнала новее его generation"""
+    for record in records:
+        if record["generation"] > index.generation:
+            index = index.apply_delta(record["added"], record["deleted"])
+            index.generation = record["generation"]
+    return index
@@ -0,0 +1,134 @@
+import csv
+import logging
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from openpyxl import load_workbook
+
+# ==========================
+# Потоковое чтение файла FAQ (xlsx / csv / tsv)
+# ==========================
+# Строки отдаются порциями по FAQ_READ_CHUNK, файл целиком в память не загружается: openpyxl
+# в режиме read_only разбирает лист по мере чтения. Листы книги читаются параллельно, каждый
+# своим потоком в свою ограниченную очередь, а отдаются по порядку листов — поэтому при повторе
+# вопроса на разных листах результат не зависит от того, какой поток успел раньше, а память
+# ограничена числом потоков x FAQ_READ_QUEUE порций, а не размером файла.
+
+FAQ_READ_CHUNK = 1000       # Строк в одной порции
+FAQ_READ_QUEUE = 4          # Порций, которые поток листа может прочитать наперёд
+FAQ_SHEET_THREADS = 4       # Сколько листов читается одновременно
+FAQ_COLUMNS = ('question', 'answer')
+
+_DELIMITERS = {'.csv': ',', '.tsv': '\t'}
+_DONE = object()
+
+
+def _clean(value) -> str:
+    return '' if value is None else str(value).strip().replace('#', '')
+
+
+def _column_positions(header, source: str) -> tuple[int, int]:
+    """Номера колонок question и answer по строке заголовка"""
+    names = [str(cell).strip() if cell is not None else '' for cell in header or ()]
+    missing = [column for column in FAQ_COLUMNS if column not in names]
+    if missing:
+        raise ValueError(f"{source}: нет колонок {', '.join(missing)} (нужны 'question' и 'answer')")
+    return names.index('question'), names.index('answer')
+
+
+def _chunked_rows(rows, source: str, chunk_size: int) -> Iterator[list[tuple[str, str]]]:
+    """Порции (вопрос, ответ) из итератора строк таблицы, первая строка — заголовок"""
+    q_col, a_col = _column_positions(next(rows, None), source)
+    width = max(q_col, a_col) + 1
+    chunk = []
+    for row in rows:
+        if len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        question = _clean(row[q_col])
+        if question:
+            chunk.append((question, _clean(row[a_col])))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_text_file(file_path: str, delimiter: str, chunk_size: int) -> Iterator[list[tuple[str, str]]]:
+    with open(file_path, newline='', encoding='utf-8-sig') as f:
+        yield from _chunked_rows(csv.reader(f, delimiter=delimiter), os.path.basename(file_path), chunk_size)
+
+
+def _iter_sheet(file_path: str, sheet_name: str, chunk_size: int) -> Iterator[list[tuple[str, str]]]:
+    # У каждого потока своя книга: объекты openpyxl нельзя делить между потоками
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        yield from _chunked_rows(rows, f"лист «{sheet_name}»", chunk_size)
+    finally:
+        workbook.close()
+
+
+def _put(out: queue.Queue, item, cancelled) -> bool:
+    """Кладёт порцию в очередь листа; False — чтение отменено, пока ждали места"""
+    while not cancelled():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _read_sheet_into(out: queue.Queue, file_path: str, sheet_name: str, chunk_size: int, cancelled):
+    try:
+        for chunk in _iter_sheet(file_path, sheet_name, chunk_size):
+            if not _put(out, chunk, cancelled):
+                return
+        _put(out, _DONE, cancelled)
+    except Exception as e:
+        _put(out, e, cancelled)
+
+
+def _iter_workbook(file_path: str, chunk_size: int) -> Iterator[list[tuple[str, str]]]:
+    workbook = load_workbook(file_path, read_only=True)
+    sheet_names = workbook.sheetnames
+    workbook.close()
+    if len(sheet_names) == 1:
+        yield from _iter_sheet(file_path, sheet_names[0], chunk_size)
+        return
+
+    stop = False
+    queues = [queue.Queue(maxsize=FAQ_READ_QUEUE) for _ in sheet_names]
+    imported = 0
+    with ThreadPoolExecutor(max_workers=FAQ_SHEET_THREADS, thread_name_prefix="faq-sheet") as executor:
+        for out, sheet_name in zip(queues, sheet_names):
+            executor.submit(_read_sheet_into, out, file_path, sheet_name, chunk_size, lambda: stop)
+        try:
+            for out, sheet_name in zip(queues, sheet_names):
+                while (item := out.get()) is not _DONE:
+                    if isinstance(item, ValueError):
+                        logging.warning(f"[FaqReader] Лист пропущен: {item}")
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+                else:
+                    imported += 1
+        finally:
+            stop = True   # потоки недочитанных листов завершаются, не дожидаясь места в очереди
+    if not imported:
+        raise ValueError("Ни на одном листе нет колонок 'question' и 'answer'")
+
+
+def iter_faq_rows(file_path: str, chunk_size: int = FAQ_READ_CHUNK) -> Iterator[list[tuple[str, str]]]:
+    """
+    Строки FAQ-файла порциями [(вопрос, ответ), ...] в порядке файла; пустые вопросы пропускаются.
+    .csv / .tsv читаются модулем csv, остальное — как книга Excel (все листы с нужными колонками).
+    """
+    delimiter = _DELIMITERS.get(os.path.splitext(file_path)[1].lower())
+    if delimiter is not None:
+        return _iter_text_file(file_path, delimiter, chunk_size)
+    return _iter_workbook(file_path, chunk_size)
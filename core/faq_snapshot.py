@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+
+from . import db_async
+from .cache import LRUCache
+
+# ==========================
+# Снимок FAQ в памяти процесса
+# ==========================
+# Версия FAQ (meta.faq_version) и число вопросов с ответом держатся в неизменяемом снимке.
+# Обработчик читает версию один раз на сообщение и передаёт её дальше — в поиск (ключ кэша
+# запросов) и в кнопки; число вопросов пересчитывается только при смене версии. Сами вопросы
+# для поиска лежат в индексе FAQ, здесь их не дублируем. Подмена — одно присваивание ссылки,
+# поэтому обработчик, уже взявший снимок, дорабатывает с ним.
+#
+# Ответы на показанные пользователю варианты подгружаются заранее, одним запросом, в LRU-кэш
+# с ключом (версия FAQ, question_hash); версия и хэш зашиты в кнопку, поэтому нажатие
+# обслуживается из памяти, а после изменения FAQ старые ответы просто вытесняются.
+
+ANSWER_CACHE_SIZE = 5000    # Ответов в кэше
+
+
+class FaqSnapshot:
+    """Неизменяемый снимок FAQ одной версии: версия и число вопросов с ответом"""
+
+    __slots__ = ("version", "size")
+
+    def __init__(self, version: int, size: int):
+        self.version = version
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+_snapshot = FaqSnapshot(-1, 0)
+_refresh_lock = asyncio.Lock()
+
+
+async def get_faq_snapshot() -> FaqSnapshot:
+    """Актуальный снимок FAQ: проверка версии — один запрос по ключу; число вопросов — только при её смене"""
+    global _snapshot
+    version = await db_async.get_faq_version()
+    if _snapshot.version == version:
+        return _snapshot
+    async with _refresh_lock:
+        if _snapshot.version != version:
+            started = time.perf_counter()
+            # Версия читается раньше числа строк: если между запросами FAQ изменится, снимок окажется
+            # новее своей метки и будет перечитан при следующем обращении, но не устареет
+            _snapshot = FaqSnapshot(version, await db_async.count_answered_faq())
+            logging.info(f"[FaqSnapshot] Версия {version}: {len(_snapshot)} вопросов "
+                         f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+    return _snapshot
+
+
+answer_cache = LRUCache(ANSWER_CACHE_SIZE)
+
+
+async def prefetch_answers(version: int, hashes: list[str]):
+    """Подгружает в кэш ответы на вопросы, которые сейчас покажут пользователю"""
+    missing = [h for h in hashes if answer_cache.get((version, h)) is None]
+    if not missing:
+        return
+    for question_hash, answer in (await db_async.get_faq_answers_by_hash(missing)).items():
+        answer_cache.put((version, question_hash), answer)
+
+
+async def get_answer(question_hash: str, version: int | None = None) -> str | None:
+    """Ответ по хэшу вопроса: из кэша, иначе одним запросом по question_hash (version=None — кнопки старого формата)"""
+    if version is not None:
+        answer = answer_cache.get((version, question_hash))
+        if answer is not None:
+            return answer
+    answer = await db_async.get_faq_answer_by_hash(question_hash)
+    if answer is not None and version is not None:
+        answer_cache.put((version, question_hash), answer)
+    return answer
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import os
+import time
+
+from . import db_async
+from .backlog import run_backlog_job
+from .nlp_utils import refresh_faq_index
+
+# ==========================
+# Горячая перезагрузка FAQ
+# ==========================
+# Файл FAQ опрашивается раз в FAQ_RELOAD_INTERVAL секунд. Если изменились его mtime или размер,
+# запускается инкрементальный импорт (merge_faq_from_excel сам пропустит файл с прежним хэшем
+# и запишет только изменённые строки), затем индекс догоняется в отдельном потоке: дельтой или
+# переобучением. Индекс сверяется со строками БД при каждой смене файла, даже если импорт ничего
+# не записал: если прошлое обновление индекса упало после импорта, повторный импорт уже ничего
+# не найдёт, а индекс всё ещё отстаёт. Новый снимок индекса подменяет старый целиком — начатые запросы дорабатывают
+# по старому, процессы поиска подхватывают новый через журнал дельт. После перезагрузки
+# вопросы без ответа перепроверяются по обновлённому FAQ.
+
+FAQ_RELOAD_INTERVAL = 30    # Как часто проверять файл FAQ, секунд
+
+
+def _source_stamp(source: str):
+    try:
+        st = os.stat(source)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+async def reload_faq(source: str) -> bool:
+    """Импортирует изменения файла FAQ и обновляет индекс; False — ни в БД, ни в индексе ничего не изменилось"""
+    started = time.perf_counter()
+    new, updated = await db_async.merge_faq_from_excel(source)
+    imported = time.perf_counter() - started
+    entries = await db_async.get_all_faq_entries()
+    changed, deleted = await asyncio.to_thread(refresh_faq_index, entries)
+    if not (new or updated or changed or deleted):
+        return False
+    logging.info(f"[FaqWatcher] FAQ перезагружен за {time.perf_counter() - started:.2f} с "
+                 f"(импорт {imported:.2f} с): новых строк {new}, изменённых {updated}; "
+                 f"в индексе добавлено/изменено {changed}, удалено {deleted}")
+    return True
+
+
+async def watch_faq(source: str, interval: float = FAQ_RELOAD_INTERVAL):
+    """Фоновая задача: следит за файлом FAQ до отмены"""
+    last_stamp = None   # первая проверка всегда доходит до импорта: файл могли изменить после старта
+    logging.info(f"[FaqWatcher] Слежение за {source} (раз в {interval} с)")
+    while True:
+        stamp = _source_stamp(source)
+        if stamp is not None and stamp != last_stamp:
+            try:
+                if await reload_faq(source):
+                    await run_backlog_job()
+                last_stamp = stamp
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"[FaqWatcher] Ошибка перезагрузки FAQ: {e}")
+        await asyncio.sleep(interval)
@@ -4,11 +4,13 @@ from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.dispatcher.dispatcher import Dispatcher
 import logging
-import hashlib
-from .database import get_user_questions, delete_user_question, add_user_question
-from .database import get_faq_answer,insert_faq_question,is_user_registered,insert_user,get_all_faq_questions,log_unanswered_question,get_question_by_hash
+from .db_async import get_user_questions, delete_user_question
+from .write_behind import write_behind
+from .user_registry import is_user_registered, insert_user
+from .faq_snapshot import get_faq_snapshot, prefetch_answers, get_answer
 from .registration import start_registration, process_name, process_phone, RegistrationStates
-from .nlp_utils import find_similar_questions
+from .search_service import search_service
+from .faq_export import send_faq_export
 # from core.keyboards import get_main_menu_keyboard
 
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -85,7 +87,7 @@ def get_main_menu_keyboard():
 
 async def handle_status(message: Message):
     user_id = message.from_user.id
-    questions = get_user_questions(user_id)
+    questions = await get_user_questions(user_id)
     total = len(questions)
     answered = len([q for q in questions if q[2]])
     unanswered = len([q for q in questions if not q[2]])
@@ -101,8 +103,9 @@ async def handle_status(message: Message):
 
 async def delete_question_callback(callback: CallbackQuery):
     user_id = callback.from_user.id
-    q_id = int(callback.data.split(":")[1])
-    success = delete_user_question(user_id, q_id)
+    # deleteq:<id> — строка user_questions, deleteq:legacy:<id> — строка ещё не перенесённой личной таблицы
+    *source, q_id = callback.data.split(":")[1:]
+    success = await delete_user_question(user_id, int(q_id), legacy=source == ["legacy"])
     if success:
         await callback.message.answer("✅ Вопрос удалён из вашего списка.")
     else:
@@ -111,36 +114,36 @@ async def delete_question_callback(callback: CallbackQuery):
 
 async def handle_my_questions(message: Message):
     user_id = message.from_user.id
-    questions = get_user_questions(user_id)
+    questions = await get_user_questions(user_id)
     if not questions:
         await message.answer("📂 У вас пока нет вопросов.")
         return
 
     text = "📂 Ваши вопросы:\n\n"
     status_map = {"green": "🟢", "yellow": "🟡", "red": "🔴"}
-    for q_id, q, a, s in questions:
+    for q_id, q, a, s, legacy in questions:
         text += f"{status_map.get(s,'❔')} {q}\n"
     await message.answer(text)
 
 async def handle_edit_questions(message: Message):
     user_id = message.from_user.id
-    questions = get_user_questions(user_id)
+    questions = await get_user_questions(user_id)
     if not questions:
         await message.answer("✏️ У вас пока нет вопросов для редактирования.")
         return
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-    for q_id, q, a, s in questions:
+    for q_id, q, a, s, legacy in questions:
         keyboard.inline_keyboard.append([
             InlineKeyboardButton(
                 text=f"🗑 {q[:30]}...",
-                callback_data=f"deleteq:{q_id}"
+                callback_data=f"deleteq:legacy:{q_id}" if legacy else f"deleteq:{q_id}"
             )
         ])
     await message.answer("✏️ Выберите вопрос для удаления:", reply_markup=keyboard)
 
 async def cmd_start(message: Message):
-    if is_user_registered(message.from_user.id):
+    if await is_user_registered(message.from_user.id):
         welcome_text = (
             "🤖 **Добро пожаловать в бот поддержки!**\n\n"
             "Выберите нужную опцию из меню ниже или просто напишите ваш вопрос."
@@ -157,7 +160,7 @@ async def cmd_start(message: Message):
         )
 
 async def handle_faq(message: Message):
-    await message.answer("Здесь будет выгрузка FAQ.")
+    await export_faq_handler(message)
 
 INSTRUCTION_TEXT = (
     "🤖✨ Привет! FAQ бот-помощник ауф\n\n"
@@ -188,7 +191,7 @@ async def handle_main_menu(message: Message):
 async def contact_handler(message: Message, state: FSMContext):
     if message.contact:
         user = message.from_user
-        insert_user(
+        await insert_user(
             user_id=user.id,
             username=user.username or '',
             phone=message.contact.phone_number,
@@ -234,8 +237,12 @@ async def back_to_main_menu(message: Message):
     )
 
 async def export_faq_handler(message: Message):
-    """Заглушка: выгрузка FAQ"""
-    await message.answer("📥 Функция выгрузки FAQ в разработке...")
+    """Выгрузка FAQ файлом"""
+    try:
+        await send_faq_export(message)
+    except Exception as e:
+        logging.error(f"Ошибка выгрузки FAQ: {e}")
+        await message.answer("⚠️ Не удалось выгрузить FAQ, попробуйте позже.")
 
 async def create_ticket_handler(message: Message):
     """Заглушка: создание задачи"""
@@ -246,29 +253,30 @@ unanswered_map = {}
 async def faq_handler(message: Message, state: FSMContext):
     if message.text in ["❓ HELP", "📋 MENU", "📥 Выгрузка FAQ", "📖 Инструкция", "🎫 Создать задачу", "◀️ Назад"]:
         return
-    if not is_user_registered(message.from_user.id):
+    if not await is_user_registered(message.from_user.id):
         await message.answer("❌ Сначала пройдите регистрацию!", reply_markup=CONTACT_KB)
         return
     user_question = message.text.strip()
-    faq_questions = get_all_faq_questions()
-    if not faq_questions:
+    snapshot = await get_faq_snapshot()
+    if not snapshot:
         await message.answer("⚠️ База знаний пуста. Ожидайте ответа от оператора.")
         return
-    similar = find_similar_questions(user_question, faq_questions)
+    similar = await search_service.find_similar(user_question, snapshot.version)
     if similar:
         # сортируем по средней оценке (desc)
         similar = sorted(similar, key=lambda x: x[1], reverse=True)
+        hashes = [item[4] for item in similar]     # question_hash приходит из индекса
+        await prefetch_answers(snapshot.version, hashes)
         keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-        for item in similar:
+        for item, q_hash in zip(similar, hashes):
             q = item[0]
             avg = item[1] if len(item) > 1 else 0.0
             count = item[2] if len(item) > 2 else 1
             display_text = q[:35] + ("..." if len(q) > 35 else "")
             score_text = f" (🔎={avg:.2f}|⚙={count})"
             btn_text = f"{display_text}{score_text}"
-            q_hash = hashlib.sha256(q.encode()).hexdigest()[:16]
             keyboard.inline_keyboard.append(
-                [InlineKeyboardButton(text=btn_text, callback_data=f"faq:{q_hash}")]
+                [InlineKeyboardButton(text=btn_text, callback_data=f"faq:{snapshot.version}:{q_hash}")]
             )
         keyboard.inline_keyboard.append(
             [InlineKeyboardButton(text="🔴Нет ответа на мой вопрос🔴", callback_data="unanswered:add")]
@@ -277,8 +285,8 @@ async def faq_handler(message: Message, state: FSMContext):
         unanswered_map[(bot_msg.chat.id, bot_msg.message_id)] = user_question
     else:
         # Если ничего не найдено — сохраняем и уведомляем (как раньше)
-        insert_faq_question(user_question)
-        log_unanswered_question(user_question)
+        write_behind.log_unanswered(user_question)
+        write_behind.add_user_question(message.from_user.id, user_question)
         await message.answer("📝 Вопрос передан специалистам. Мы ответим вам в ближайшее время!")
 
 async def handle_unanswered(callback: CallbackQuery):
@@ -288,8 +296,8 @@ async def handle_unanswered(callback: CallbackQuery):
         if not user_q:
             await callback.answer("Вопрос добавлен. (оригинал не найден в кеше)", show_alert=True)
             return
-        insert_faq_question(user_q)
-        log_unanswered_question(user_q)
+        write_behind.log_unanswered(user_q)
+        write_behind.add_user_question(callback.from_user.id, user_q)
         await callback.answer("📝 Ваш вопрос добавлен в список для оператора. Спасибо!", show_alert=True)
         await callback.message.reply("Вопрос добавлен в очередь оператору. Мы уведомим вас, когда ответим.")
     except Exception as e:
@@ -299,11 +307,12 @@ async def handle_unanswered(callback: CallbackQuery):
 
 async def process_faq_choice(callback: CallbackQuery):
     try:
-        question_hash = callback.data.split(":")[1]
-        original_question = get_question_by_hash(question_hash)
-        if not original_question:
+        # faq:<версия FAQ>:<хэш вопроса>; у кнопок, отправленных до появления версии, — faq:<хэш>
+        parts = callback.data.split(":")
+        version = int(parts[1]) if len(parts) > 2 else None
+        answer = await get_answer(parts[-1], version)
+        if answer is None:
             raise ValueError("Question not found")
-        answer = get_faq_answer(original_question)
         await callback.message.answer(f"💡 {answer}")
     except Exception:
         await callback.answer("⚠️ Ответ временно недоступен", show_alert=True)
@@ -319,7 +328,7 @@ async def inline_menu_handler(callback: CallbackQuery):
         action = callback.data.split(":")[1]
 
         if action == "export":
-            await callback.message.answer("📥 **Выгрузка FAQ** в разработке...")
+            await export_faq_handler(callback.message)
 
         elif action == "instruction":
             await callback.message.answer(INSTRUCTION_TEXT)
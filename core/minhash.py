@@ -0,0 +1,77 @@
+import zlib
+
+import numpy as np
+
+# ==========================
+# MinHash + LSH для поиска почти одинаковых текстов
+# ==========================
+# Сигнатура MinHash (num_perm минимумов хэшей по множеству шинглов): доля совпавших позиций
+# двух сигнатур оценивает их коэффициент Жаккара. Сигнатура режется на bands полос по rows
+# позиций; тексты с совпавшей хотя бы одной полосой становятся кандидатами. Порог, с которого
+# пары почти наверняка находятся, ~ (1 / bands) ** (1 / rows): при 16 x 4 — около 0.5.
+
+
+class MinHasher:
+    """Сигнатуры MinHash: хэш шингла crc32, перестановки — multiply-shift хэши по модулю 2^64"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) | np.uint64(1)   # нечётные множители
+        self._b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+
+    def signatures(self, shingle_sets: list[set[str]], chunk_size: int = 65536) -> np.ndarray:
+        """Сигнатуры для списка множеств шинглов (тексты x num_perm, uint32); пустое множество — все 0xFFFFFFFF"""
+        sizes = np.fromiter((len(s) for s in shingle_sets), dtype=np.int64, count=len(shingle_sets))
+        result = np.full((len(shingle_sets), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        hashes = np.fromiter((zlib.crc32(s.encode()) for shingles in shingle_sets for s in shingles),
+                             dtype=np.uint64, count=int(sizes.sum()))
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+        # Тексты обрабатываются порциями по ~chunk_size шинглов: матрица хэшей num_perm x порция
+        start = 0
+        while start < len(shingle_sets):
+            end = max(int(np.searchsorted(bounds, bounds[start] + chunk_size, side="right")) - 1, start + 1)
+            end = min(end, len(shingle_sets))
+            lo, hi = bounds[start], bounds[end]
+            nonempty = np.flatnonzero(sizes[start:end]) + start
+            if hi > lo:
+                with np.errstate(over="ignore"):
+                    permuted = (np.outer(self._a, hashes[lo:hi]) + self._b[:, None]) >> np.uint64(32)
+                mins = np.minimum.reduceat(permuted, bounds[nonempty] - lo, axis=1)
+                result[nonempty] = mins.T.astype(np.uint32)
+            start = end
+        return result
+
+    def signature(self, shingles: set[str]) -> np.ndarray:
+        return self.signatures([shingles])[0]
+
+
+def estimate_jaccard(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class MinHashLSH:
+    """LSH-индекс сигнатур: полоса сигнатуры -> ключ (первый добавленный с такой полосой)"""
+
+    def __init__(self, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets: list[dict[bytes, int]] = [{} for _ in range(bands)]
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [band.tobytes() for band in signature.reshape(self.bands, self.rows)]
+
+    def add(self, signature: np.ndarray, key: int):
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(band, key)
+
+    def query(self, signature: np.ndarray) -> set[int]:
+        """Ключи, у которых совпала хотя бы одна полоса"""
+        found = set()
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            key = bucket.get(band)
+            if key is not None:
+                found.add(key)
+        return found
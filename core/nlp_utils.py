@@ -1,15 +1,22 @@
+import os
 import re
+import time
 import logging
+import threading
 import numpy as np
-from difflib import SequenceMatcher
 from collections import Counter
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from fuzzywuzzy import fuzz
+from difflib import SequenceMatcher
+from functools import lru_cache
+from rapidfuzz import fuzz, process
 from nltk.corpus import stopwords
 from nltk.stem import SnowballStemmer
 import nltk
 
+from .database import DB_PATH, fts_idf, fts_search, generate_question_hash
+from .faq_index import (FaqIndex, CURRENT_FILE, DELTA_LOG_FILE, append_delta_log, read_delta_log,
+                        replay_delta_log, truncate_delta_log)
+from .cache import LRUCache
+
 # ==========================
 # NLP Настройки и инициализация
 # ==========================
@@ -27,169 +34,651 @@ SEQUENCE_THRESHOLD = 0.25    # SequenceMatcher, 0.0-1.0
 SUBWORD_THRESHOLD = 0.25     # Частичная подсловная схожесть
 LEVENSHTEIN_THRESHOLD = 3   # Максимальное расстояние редактирования
 JACCARD_THRESHOLD = 0.3     # Jaccard similarity, 0.0-1.0
-# EMBBEDDING_THRESHOLD = 0.5 # (если будем добавлять семантический поиск)
+EMBEDDING_THRESHOLD = 0.5  # Семантическая (LSA) косинусная схожесть, 0.0-1.0
+FTS_THRESHOLD = 0.5        # BM25 полнотекстового индекса SQLite, делённый на сумму idf стемов запроса, 0.0-1.0
 # PHONETIC_THRESHOLD = 0.5   # (если будем добавлять фонетику)
 
 TOP_N_RESULTS = 5           # Количество результатов для отображения пользователю
+RAPIDFUZZ_WORKERS = -1      # Потоков для пакетного подсчёта RapidFuzz (-1 — все ядра)
+LSA_COMPONENTS = 64         # Размерность семантических векторов (TruncatedSVD над TF-IDF)
+LSA_TOP_K = 50              # Сколько ближайших по смыслу вопросов засчитывать семантическому методу
+
+# Приближённый поиск (IVF) для семантического метода на больших базах
+ANN_MIN_ROWS = 50000        # С какого размера FAQ строить IVF-индекс (меньше — точный перебор)
+ANN_NLIST = 0               # Число кластеров (0 — 4 * sqrt(число вопросов))
+ANN_NPROBE = 8              # Сколько кластеров сканировать на запрос: больше — точнее, но медленнее
+
+# Каскад: точное совпадение -> векторные методы (TF-IDF, Subword, Jaccard, LSA, FTS5) -> символьные (Fuzzy, Sequence, Levenshtein)
+CASCADE_EXACT_MATCH = True      # Уровень 0: точное совпадение по question_hash / нормализованной форме
+CASCADE_VECTOR_CUTOFF = 0.8     # Уровень 1: если лучший результат векторных методов не ниже — символьные не запускаем
+CASCADE_VECTOR_MIN_METHODS = 2  # ...и его нашли не меньше стольких векторных методов
+TIER_EXACT, TIER_VECTOR, TIER_CHAR = 0, 1, 2   # уровень каскада, давший результат (последнее поле результата)
+
+# Пакетный поиск: запросов в одном пакете не больше BATCH_MAX_CELLS / размер FAQ
+# (матрица оценок одного метода — 4 байта на ячейку)
+BATCH_MAX_CELLS = 4_000_000
+
+# Отбор кандидатов по обратному индексу (стемы + символьные триграммы)
+CANDIDATE_LIMIT = 2000      # Максимум кандидатов на запрос; FAQ меньше этого размера перебирается целиком
+CANDIDATE_MIN = 20          # Если кандидатов меньше — полный перебор, чтобы не терять полноту
+CANDIDATE_TRIGRAMS = True   # Добавлять кандидатов по общим триграммам (опечатки для символьных методов)
+
+# Каталог с сохранённым TF-IDF индексом (рядом с bot_data.db)
+FAQ_INDEX_DIR = os.path.join(os.path.dirname(DB_PATH), 'faq_index')
+
+# Инкрементальные изменения индекса: база переобучается в фоне, когда добавленных и удалённых строк
+# становится больше max(COMPACT_MIN_ROWS, COMPACT_RATIO * размер базы)
+COMPACT_MIN_ROWS = 1000
+COMPACT_RATIO = 0.1
+
+# Кэш результатов поиска: ключ — (версия FAQ, поколение индекса, нормализованный запрос)
+QUERY_CACHE_SIZE = 10000    # Максимум запросов в кэше
+QUERY_CACHE_TTL = 3600      # Время жизни результата, секунд
+QUERY_CACHE_PERSIST = 500   # Сколько самых частых запросов сохранять между перезапусками (0 — не сохранять)
+QUERY_CACHE_FILE = os.path.join(os.path.dirname(DB_PATH), 'query_cache.json')
 
 # ==========================
 # Препроцессинг
 # ==========================
+@lru_cache(maxsize=None)
+def stem_word(word: str) -> str:
+    """Стем слова; мемоизирован, стеммер вызывается один раз на слово за время жизни процесса"""
+    return STEMMER.stem(word)
+
 def preprocess_text(text: str) -> str:
     """Приводит текст к нижнему регистру, убирает пунктуацию, стоп-слова и стеммит слова"""
     text = text.lower()
     text = re.sub(r'[^\w\s]', '', text)
     words = text.split()
-    words = [STEMMER.stem(word) for word in words if word not in STOPWORDS]
+    words = [stem_word(word) for word in words if word not in STOPWORDS]
     return ' '.join(words)
 
+_FUZZY_NON_WORD = re.compile(r'(?ui)\W')
+_FUZZY_LATIN1 = {code: None for code in range(128, 256)}
+
+def fuzzy_process(text: str) -> str:
+    """Нормализация как у fuzzywuzzy (full_process, force_ascii=True), чтобы оценки Fuzzy не изменились"""
+    return _FUZZY_NON_WORD.sub(' ', text.translate(_FUZZY_LATIN1)).lower().strip()
+
+# ==========================
+# Индекс FAQ
+# ==========================
+_faq_index: FaqIndex | None = None
+_index_lock = threading.Lock()          # применение дельт и подмена снимка после компактизации
+_compaction: threading.Thread | None = None
+_index_owner = False                    # процесс, который пишет дельты (основной); остальные догоняют по журналу
+_index_sync = {"current": None, "log": None, "offset": 0}
+
+def _prepare_entries(entries) -> list[tuple]:
+    """Дополняет строки (id, вопрос, tokens, question_hash) недостающими tokens и хэшами"""
+    return [
+        (faq_id, q, t if t is not None else preprocess_text(q), h if h is not None else generate_question_hash(q))
+        for faq_id, q, t, h in entries
+    ]
+
+def _fit_index(entries: list[tuple], generation: int = 0) -> FaqIndex:
+    """Полное обучение: TF-IDF, LSA и, для больших баз, IVF"""
+    index = FaqIndex.fit(entries, generation)
+    index.fit_lsa(LSA_COMPONENTS)
+    if len(entries) >= ANN_MIN_ROWS:
+        index.build_ann(ANN_NLIST or int(4 * np.sqrt(len(entries))))
+    return index
+
+def _save_index(index: FaqIndex, index_dir: str):
+    try:
+        index.save(index_dir)
+        truncate_delta_log(index_dir, index.generation)
+    except OSError as e:
+        logging.error(f"[FaqIndex] Не удалось сохранить индекс: {e}")
+
+def _file_stamp(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+def _load_with_deltas(index_dir: str) -> FaqIndex | None:
+    """База с диска + журнал дельт; запоминает, до какого места журнал прочитан"""
+    current = _file_stamp(os.path.join(index_dir, CURRENT_FILE))
+    index = FaqIndex.load(index_dir)
+    if index is None:
+        return None
+    records, offset = read_delta_log(index_dir)
+    _index_sync.update(current=current, log=_file_stamp(os.path.join(index_dir, DELTA_LOG_FILE)), offset=offset)
+    return replay_delta_log(index, records)
+
+def _compaction_limit(index: FaqIndex) -> float:
+    return max(COMPACT_MIN_ROWS, COMPACT_RATIO * index.base.size)
+
+def _diff_entries(index: FaqIndex, entries: list[tuple]):
+    """Строки для apply_delta, приводящие индекс к entries; None — если сравнить по faq.id нельзя"""
+    if any(e[0] is None for e in entries) or any(i is None for i in index.ids):
+        return None
+    added = []
+    seen = set()
+    for entry in entries:
+        faq_id, question, _, question_hash = entry
+        seen.add(faq_id)
+        pos = index.id_positions.get(faq_id)
+        if pos is None or index.questions[pos] != question or (
+                question_hash is not None and index.hashes[pos] != question_hash):
+            added.append(entry)
+    deleted = [faq_id for faq_id in index.id_positions if faq_id not in seen]
+    return added, deleted
+
+def build_faq_index(entries: list[tuple], index_dir: str = FAQ_INDEX_DIR) -> FaqIndex:
+    """
+    Индекс по строкам FAQ (id, вопрос, tokens, question_hash) — как их отдаёт get_all_faq_entries.
+    Сохранённый индекс догоняется дельтой, если строк изменилось немного, иначе обучается заново.
+    Вызывается один раз при старте, сразу после синхронизации FAQ; процесс становится владельцем индекса.
+    """
+    global _faq_index, _index_owner
+    _index_owner = True
+    started = time.perf_counter()
+    index = _load_with_deltas(index_dir)
+    diff = _diff_entries(index, entries) if index is not None else None
+    if diff is not None and not diff[0] and not diff[1]:
+        logging.info(f"[FaqIndex] Индекс загружен с диска: {index.n_live} вопросов")
+        _faq_index = index
+    elif diff is not None and len(diff[0]) + len(diff[1]) + index.delta_size <= _compaction_limit(index):
+        _faq_index = index
+        index = apply_faq_delta(*diff, index_dir=index_dir)
+    else:
+        index = _fit_index(_prepare_entries(entries), index.generation + 1 if index is not None else 0)
+        _save_index(index, index_dir)
+        _faq_index = index
+        logging.info(f"[FaqIndex] Индекс обучен заново: {len(index)} вопросов "
+                     f"за {time.perf_counter() - started:.2f} с")
+    return index
+
+def refresh_faq_index(entries: list[tuple], index_dir: str = FAQ_INDEX_DIR) -> tuple[int, int]:
+    """
+    Приводит текущий индекс к строкам FAQ после повторной синхронизации (без перезапуска бота).
+    Небольшие изменения применяются дельтой, крупные — полным переобучением; в обоих случаях
+    готовый снимок подменяет старый целиком. Возвращает (добавлено/изменено, удалено).
+    """
+    global _faq_index
+    started = time.perf_counter()
+    index = get_faq_index()
+    diff = _diff_entries(index, entries)
+    if diff is not None and not diff[0] and not diff[1]:
+        return 0, 0
+    if diff is not None and len(diff[0]) + len(diff[1]) + index.delta_size <= _compaction_limit(index):
+        apply_faq_delta(*diff, index_dir=index_dir)
+        return len(diff[0]), len(diff[1])
+    # Фоновая компактизация сохранила бы поверх новой базы старую — дожидаемся её
+    compaction = _compaction
+    if compaction is not None:
+        compaction.join()
+    rebuilt = _fit_index(_prepare_entries(entries), index.generation + 1)
+    with _index_lock:
+        _save_index(rebuilt, index_dir)
+        _faq_index = rebuilt
+    logging.info(f"[FaqIndex] Индекс обучен заново: {len(rebuilt)} вопросов "
+                 f"за {time.perf_counter() - started:.2f} с")
+    if diff is None:
+        return len(entries), index.n_live
+    return len(diff[0]), len(diff[1])
+
+def apply_faq_delta(added: list[tuple], deleted: list[int], index_dir: str = FAQ_INDEX_DIR) -> FaqIndex:
+    """
+    Применяет изменения FAQ без переобучения: added — новые и изменённые строки (id, вопрос, tokens, question_hash),
+    deleted — faq.id удалённых. Новый снимок подменяет текущий целиком, поиск по старому не прерывается.
+    """
+    global _faq_index
+    started = time.perf_counter()
+    added = _prepare_entries(added)
+    with _index_lock:
+        index = get_faq_index().apply_delta(added, deleted)
+        try:
+            append_delta_log(index_dir, index.generation, added, deleted)
+        except OSError as e:
+            logging.error(f"[FaqIndex] Не удалось записать дельту в журнал: {e}")
+        _faq_index = index
+    logging.info(f"[FaqIndex] Дельта {index.generation}: добавлено/изменено {len(added)}, удалено {len(deleted)} "
+                 f"за {(time.perf_counter() - started) * 1000:.1f} мс; в дельте {index.delta_size} строк")
+    if index.delta_size > _compaction_limit(index):
+        start_compaction(index_dir)
+    return index
+
+def compact_faq_index(index_dir: str = FAQ_INDEX_DIR) -> FaqIndex:
+    """Переобучает базу по живым строкам и сохраняет её; дельты, пришедшие во время обучения, применяются поверх"""
+    global _faq_index
+    started = time.perf_counter()
+    snapshot = get_faq_index()
+    compacted = _fit_index(snapshot.live_entries(), snapshot.generation)
+    with _index_lock:
+        _save_index(compacted, index_dir)
+        records, _ = read_delta_log(index_dir)
+        _faq_index = replay_delta_log(compacted, records)
+    logging.info(f"[FaqIndex] Компактизация: {snapshot.delta_size} строк дельты влито в базу "
+                 f"({len(compacted)} вопросов) за {time.perf_counter() - started:.2f} с")
+    return _faq_index
+
+def start_compaction(index_dir: str = FAQ_INDEX_DIR):
+    """Компактизация в фоновом потоке (не больше одной одновременно)"""
+    global _compaction
+    with _index_lock:
+        if _compaction is not None and _compaction.is_alive():
+            return
+        _compaction = threading.Thread(target=_run_compaction, args=(index_dir,), name="faq-compaction", daemon=True)
+        _compaction.start()
+
+def _run_compaction(index_dir: str):
+    try:
+        compact_faq_index(index_dir)
+    except Exception as e:
+        logging.error(f"[FaqIndex] Ошибка компактизации: {e}")
+
+def load_faq_index(index_dir: str = FAQ_INDEX_DIR) -> FaqIndex | None:
+    """
+    Загружает сохранённый индекс с журналом дельт без проверки актуальности (процессы-обработчики поиска).
+    Вспомогательные структуры поиска строятся сразу, чтобы их не ждал первый запрос после загрузки.
+    """
+    global _faq_index
+    index = _load_with_deltas(index_dir)
+    if index is not None:
+        started = time.perf_counter()
+        index.warm(fuzzy_process)
+        logging.info(f"[FaqIndex] Индекс подготовлен к поиску за {time.perf_counter() - started:.2f} с")
+        _faq_index = index
+    return index
+
+def sync_faq_index(index_dir: str = FAQ_INDEX_DIR):
+    """
+    Догоняет изменения, сделанные процессом-владельцем: новая база (CURRENT) — перезагрузка,
+    новые записи журнала — применение дельт. Проверка — два stat, вызывается перед каждым запросом.
+    """
+    global _faq_index
+    if _index_owner:
+        return
+    current = _file_stamp(os.path.join(index_dir, CURRENT_FILE))
+    if current != _index_sync["current"]:
+        if load_faq_index(index_dir) is not None:
+            logging.info(f"[FaqIndex] Загружена новая база индекса (дельта {_faq_index.generation})")
+        return
+    log = _file_stamp(os.path.join(index_dir, DELTA_LOG_FILE))
+    if log == _index_sync["log"] or _faq_index is None:
+        return
+    offset = _index_sync["offset"]
+    if log is None or _index_sync["log"] is None or log[0] != _index_sync["log"][0]:
+        # Журнал переписан после компактизации — читаем с начала; лишние записи отсеет generation
+        offset = 0
+    records, offset = read_delta_log(index_dir, offset)
+    _index_sync.update(log=log, offset=offset)
+    _faq_index = replay_delta_log(_faq_index, records)
+
+def get_faq_index(faq_questions: list[str] | None = None) -> FaqIndex:
+    """Текущий снимок индекса; если передан другой список вопросов — обучает индекс по нему в памяти"""
+    global _faq_index
+    index = _faq_index
+    if faq_questions is None:
+        if index is None:
+            raise RuntimeError("Индекс FAQ не загружен: вызовите build_faq_index или load_faq_index")
+        return index
+    if index is None or index.live_questions != faq_questions:
+        logging.info("[FaqIndex] Список FAQ изменился, перестраиваем индекс")
+        index = _faq_index = _fit_index(_prepare_entries([(None, q, None, None) for q in faq_questions]))
+    return index
+
 # ==========================
 # Методы поиска
 # ==========================
-def tfidf_search(user_question: str, faq_questions: list[str]):
-    """Поиск с помощью TF-IDF + косинусная схожесть"""
-    if not faq_questions:
-        return []
-    processed_questions = [preprocess_text(q) for q in faq_questions]
-    vectorizer = TfidfVectorizer()
-    faq_vectors = vectorizer.fit_transform(processed_questions)
-    user_vector = vectorizer.transform([preprocess_text(user_question)])
-    similarities = cosine_similarity(user_vector, faq_vectors)[0]
-    results = [(faq_questions[i], sim) for i, sim in enumerate(similarities) if sim >= TFIDF_THRESHOLD]
-    logging.info(f"[TF-IDF] Найдено {len(results)} совпадений")
-    return results
+# Каждый метод возвращает вектор float32 длины len(FAQ), выровненный по номерам вопросов индекса:
+# оценка там, где она посчитана, NaN — где вопрос не оценивался (не кандидат / заведомо не подходит).
+def _empty_scores(index: FaqIndex) -> np.ndarray:
+    return np.full(len(index.questions), np.nan, dtype=np.float32)
 
-def fuzzy_search(user_question: str, faq_questions: list[str]):
-    """Поиск по Fuzzy string matching"""
-    results = []
-    for q in faq_questions:
-        score = fuzz.token_set_ratio(user_question, q)
-        if score >= FUZZY_THRESHOLD:
-            results.append((q, score / 100))
-    logging.info(f"[Fuzzy] Найдено {len(results)} совпадений")
-    return results
+# Пакетный поиск (find_similar_questions_batch) не пишет в лог подробности по каждому запросу
+_search_log = threading.local()
 
-def sequence_search(user_question: str, faq_questions: list[str]):
-    """Поиск по SequenceMatcher (частичная схожесть символов)"""
-    results = []
-    for q in faq_questions:
-        score = SequenceMatcher(None, user_question, q).ratio()
-        if score >= SEQUENCE_THRESHOLD:
-            results.append((q, score))
-    logging.info(f"[SequenceMatcher] Найдено {len(results)} совпадений")
-    return results
+def _log(message: str):
+    if not getattr(_search_log, "quiet", False):
+        logging.info(message)
 
-def subword_search(user_question: str, faq_questions: list[str]):
-    """Подсловный поиск: проверка совпадений подстрок"""
-    results = []
-    uq = preprocess_text(user_question)
-    for q in faq_questions:
-        pq = preprocess_text(q)
-        words_u = set(uq.split())
-        words_q = set(pq.split())
-        if not words_u:
-            continue
-        overlap = len(words_u & words_q) / len(words_u)
-        if overlap >= SUBWORD_THRESHOLD:
-            results.append((q, overlap))
-    logging.info(f"[Subword] Найдено {len(results)} совпадений")
-    return results
+def _log_matches(name: str, scores: np.ndarray, threshold: float):
+    _log(f"[{name}] Найдено {np.count_nonzero(scores >= threshold)} совпадений")
 
-def levenshtein_search(user_question: str, faq_questions: list[str]):
-    """Поиск по расстоянию Левенштейна"""
-    def levenshtein_distance(s1, s2):
-        if s1 == s2:
-            return 0
-        if len(s1) == 0:
-            return len(s2)
-        if len(s2) == 0:
-            return len(s1)
-        prev_row = range(len(s2) + 1)
-        for i, c1 in enumerate(s1):
-            curr_row = [i + 1]
-            for j, c2 in enumerate(s2):
-                insertions = prev_row[j + 1] + 1
-                deletions = curr_row[j] + 1
-                substitutions = prev_row[j] + (c1 != c2)
-                curr_row.append(min(insertions, deletions, substitutions))
-            prev_row = curr_row
-        return prev_row[-1]
+def tfidf_scores(user_question: str, index: FaqIndex, candidates: np.ndarray | None = None) -> np.ndarray:
+    """TF-IDF + косинусная схожесть по предрассчитанному индексу (ненулевые только у вопросов с общими стемами)"""
+    scores = index.tfidf_scores(preprocess_text(user_question)).astype(np.float32, copy=False)
+    _log_matches("TF-IDF", scores, TFIDF_THRESHOLD)
+    return scores
 
-    results = []
-    for q in faq_questions:
-        dist = levenshtein_distance(user_question.lower(), q.lower())
-        if dist <= LEVENSHTEIN_THRESHOLD:
-            results.append((q, 1 - dist / max(len(user_question), len(q))))
-    logging.info(f"[Levenshtein] Найдено {len(results)} совпадений")
-    return results
+def fuzzy_scores(user_question: str, index: FaqIndex, candidates: np.ndarray | None = None) -> np.ndarray:
+    """Fuzzy string matching (token_set_ratio, пакетно через RapidFuzz), оценка 0.0-1.0"""
+    scores = _empty_scores(index)
+    query = fuzzy_process(user_question)
+    if query:
+        fuzzy_questions = index.fuzzy_questions(fuzzy_process)
+        choices = fuzzy_questions if candidates is None else [fuzzy_questions[i] for i in candidates]
+        # fuzzywuzzy округлял оценку до целого, поэтому отсекаем с запасом 0.5 и округляем так же
+        raw = np.round(process.cdist(
+            [query], choices, scorer=fuzz.token_set_ratio,
+            score_cutoff=FUZZY_THRESHOLD - 0.5, workers=RAPIDFUZZ_WORKERS,
+        )[0]) / 100
+        scores[slice(None) if candidates is None else candidates] = raw
+    _log_matches("Fuzzy", scores, FUZZY_THRESHOLD / 100)
+    return scores
+
+def _sequence_ratios(user_question: str, choices: list[str], bounds: np.ndarray) -> np.ndarray:
+    """
+    SequenceMatcher.ratio() там, где он может дотянуть до порога. bounds — fuzz.ratio / 100 (2*LCS/T):
+    совпадающие блоки SequenceMatcher — общая подпоследовательность, поэтому его ratio не больше,
+    и вопросы с bounds ниже порога точно не проходят (для них 0, как раньше).
+    При SEQUENCE_THRESHOLD = 0.25 отсев слабый: на faq.xlsx для обычных запросов проходит от 45%
+    до 95% вопросов, так что метод остаётся построчным циклом SequenceMatcher на Python. Время ограничено
+    отбором кандидатов (не больше CANDIDATE_LIMIT на запрос), а не этим отсевом.
+    """
+    ratios = np.zeros(len(choices), dtype=np.float32)
+    for j in np.flatnonzero(bounds >= SEQUENCE_THRESHOLD):
+        ratios[j] = SequenceMatcher(None, user_question, choices[j]).ratio()
+    return ratios
 
-def jaccard_search(user_question: str, faq_questions: list[str]):
+def sequence_scores(user_question: str, index: FaqIndex, candidates: np.ndarray | None = None) -> np.ndarray:
+    """Поиск по SequenceMatcher (частичная схожесть символов); RapidFuzz отсекает лишь заведомо непохожие вопросы"""
+    scores = _empty_scores(index)
+    choices = index.questions if candidates is None else [index.questions[i] for i in candidates]
+    bounds = process.cdist(
+        [user_question], choices, scorer=fuzz.ratio,
+        score_cutoff=SEQUENCE_THRESHOLD * 100, workers=RAPIDFUZZ_WORKERS,
+    )[0] / 100
+    scores[slice(None) if candidates is None else candidates] = _sequence_ratios(user_question, choices, bounds)
+    _log_matches("SequenceMatcher", scores, SEQUENCE_THRESHOLD)
+    return scores
+
+def _stem_overlap(user_question: str, index: FaqIndex) -> np.ndarray:
+    """Доля стемов запроса, встречающихся в вопросе (по обратному индексу)"""
+    words_u = set(preprocess_text(user_question).split())
+    if not words_u:
+        return _empty_scores(index)
+    return index.token_overlap(words_u).astype(np.float32) / len(words_u)
+
+def subword_scores(user_question: str, index: FaqIndex, candidates: np.ndarray | None = None) -> np.ndarray:
+    """Подсловный поиск: проверка совпадений подстрок"""
+    scores = _stem_overlap(user_question, index)
+    _log_matches("Subword", scores, SUBWORD_THRESHOLD)
+    return scores
+
+def levenshtein_scores(user_question: str, index: FaqIndex, candidates: np.ndarray | None = None) -> np.ndarray:
+    """Расстояние Левенштейна (BK-деревья по длинам): оценка 1 - dist/maxlen только для dist <= порога"""
+    scores = _empty_scores(index)
+    for i, dist in index.edit_search(user_question.lower(), LEVENSHTEIN_THRESHOLD):
+        scores[i] = 1 - dist / max(len(user_question), len(index.questions[i]), 1)
+    _log_matches("Levenshtein", scores, -np.inf)
+    return scores
+
+def jaccard_scores(user_question: str, index: FaqIndex, candidates: np.ndarray | None = None) -> np.ndarray:
     """Поиск по Jaccard similarity (overlap слов)"""
-    uq_set = set(preprocess_text(user_question).split())
-    results = []
-    for q in faq_questions:
-        fq_set = set(preprocess_text(q).split())
-        if not uq_set:
-            continue
-        overlap = len(uq_set & fq_set) / len(uq_set)
-        if overlap >= JACCARD_THRESHOLD:
-            results.append((q, overlap))
-    logging.info(f"[Jaccard] Найдено {len(results)} совпадений")
-    return results
+    scores = _stem_overlap(user_question, index)
+    _log_matches("Jaccard", scores, JACCARD_THRESHOLD)
+    return scores
+
+def semantic_scores(user_question: str, index: FaqIndex, candidates: np.ndarray | None = None) -> np.ndarray:
+    """Семантический поиск: LSA-векторы (TruncatedSVD над TF-IDF), засчитываются LSA_TOP_K ближайших"""
+    scores = _empty_scores(index)
+    positions, values = index.semantic_scores(preprocess_text(user_question), LSA_TOP_K, ANN_NPROBE)
+    scores[positions] = values
+    _log_matches("Semantic", scores, EMBEDDING_THRESHOLD)
+    return scores
+
+def fts_scores(user_question: str, index: FaqIndex, candidates: np.ndarray | None = None) -> np.ndarray:
+    """
+    Полнотекстовый поиск SQLite FTS5 по стемам: TOP_N_RESULTS лучших по bm25. Оценка — bm25, делённый
+    на сумму idf всех стемов запроса, то есть на bm25 вопроса средней длины, содержащего каждый стем
+    по разу (не больше 1). Вопрос, совпавший лишь по части стемов, получает долю по их idf, поэтому
+    одно редкое слово в длинном постороннем запросе порог не проходит, даже если это лучшее найденное.
+    Работает только для индекса, построенного по строкам faq (есть faq.id).
+    """
+    scores = _empty_scores(index)
+    stems = list(dict.fromkeys(preprocess_text(user_question).split()))
+    if stems and index.ids and index.ids[0] is not None:
+        found = fts_search(stems, TOP_N_RESULTS)
+        # N для idf — живые строки индекса, а не COUNT(*) по faq на каждый запрос
+        full = sum(fts_idf(stems, index.n_live)) if found else 0.0
+        for faq_id, rank in found:
+            pos = index.id_positions.get(faq_id)
+            if pos is not None and full > 0:
+                scores[pos] = min(1.0, -rank / full)
+    _log_matches("FTS", scores, FTS_THRESHOLD)
+    return scores
+
+# Пакетные варианты: оценки сразу для многих запросов, матрица (запросы x вопросы) по всему FAQ.
+# TF-IDF — одно разреженное умножение, Fuzzy — один вызов process.cdist. Sequence пакетно считает только
+# отсев по fuzz.ratio, сам SequenceMatcher — по строке на пару (см. _sequence_ratios).
+def tfidf_scores_batch(user_questions: list[str], index: FaqIndex) -> np.ndarray:
+    return index.tfidf_scores_batch([preprocess_text(q) for q in user_questions])
+
+def fuzzy_scores_batch(user_questions: list[str], index: FaqIndex) -> np.ndarray:
+    queries = [fuzzy_process(q) for q in user_questions]
+    scores = np.round(process.cdist(
+        queries, index.fuzzy_questions(fuzzy_process), scorer=fuzz.token_set_ratio,
+        score_cutoff=FUZZY_THRESHOLD - 0.5, workers=RAPIDFUZZ_WORKERS, dtype=np.float32,
+    )) / 100
+    scores[[not q for q in queries]] = np.nan
+    return scores
+
+def sequence_scores_batch(user_questions: list[str], index: FaqIndex) -> np.ndarray:
+    bounds = process.cdist(
+        user_questions, index.questions, scorer=fuzz.ratio,
+        score_cutoff=SEQUENCE_THRESHOLD * 100, workers=RAPIDFUZZ_WORKERS, dtype=np.float32,
+    ) / 100
+    return np.vstack([_sequence_ratios(q, index.questions, row) for q, row in zip(user_questions, bounds)])
+
+# Методы: функция оценки и порог, с которого оценка засчитывается.
+# У Левенштейна порог уже применён при поиске (NaN — расстояние больше LEVENSHTEIN_THRESHOLD).
+SEARCH_METHODS = {
+    "tfidf": (tfidf_scores, TFIDF_THRESHOLD),
+    "subword": (subword_scores, SUBWORD_THRESHOLD),
+    "jaccard": (jaccard_scores, JACCARD_THRESHOLD),
+    "fuzzy": (fuzzy_scores, FUZZY_THRESHOLD / 100),
+    "sequence": (sequence_scores, SEQUENCE_THRESHOLD),
+    "levenshtein": (levenshtein_scores, -np.inf),
+    "semantic": (semantic_scores, EMBEDDING_THRESHOLD),
+    "fts": (fts_scores, FTS_THRESHOLD),
+}
+VECTOR_METHODS = ("tfidf", "subword", "jaccard", "semantic", "fts")  # уровень 1 каскада
+CHAR_METHODS = ("fuzzy", "sequence", "levenshtein")        # уровень 2 каскада
+
+# Веса методов при усреднении оценок (1.0 — обычное среднее)
+METHOD_WEIGHTS = {
+    "tfidf": 1.0,
+    "subword": 1.0,
+    "jaccard": 1.0,
+    "fuzzy": 1.0,
+    "sequence": 1.0,
+    "levenshtein": 1.0,
+    "semantic": 1.0,
+    "fts": 1.0,
+}
+
+# ==========================
+# Отбор кандидатов
+# ==========================
+def select_candidates(user_question: str, index: FaqIndex) -> np.ndarray | None:
+    """
+    Кандидаты для оценки по обратному индексу FAQ.
+    None — оценивать весь список (маленький FAQ или слишком мало кандидатов).
+    """
+    total = len(index)
+    if total <= CANDIDATE_LIMIT:
+        return None
+    candidates = index.candidates(
+        set(preprocess_text(user_question).split()),
+        user_question if CANDIDATE_TRIGRAMS else None,
+        limit=CANDIDATE_LIMIT,
+    )
+    if len(candidates) < CANDIDATE_MIN:
+        _log(f"[Candidates] Кандидатов {len(candidates)} < {CANDIDATE_MIN}, полный перебор {total}")
+        return None
+    _log(f"[Candidates] Кандидатов: {len(candidates)} из {total} "
+                 f"(отсечено {1 - len(candidates) / total:.1%})")
+    return candidates
 
 # ==========================
 # Основная функция поиска
 # ==========================
-def find_similar_questions(user_question: str, faq_questions: list[str]):
+def exact_search(user_question: str, index: FaqIndex) -> int | None:
+    """Точное совпадение: хэш вопроса (как в faq.question_hash) или совпадение нормализованной формы"""
+    question = user_question.strip().replace('#', '')
+    return index.exact_match(generate_question_hash(question), preprocess_text(question))
+
+def _exact_result(index: FaqIndex, pos: int) -> tuple:
+    return index.questions[pos], 1.0, 1, index.ids[pos], index.hashes[pos], TIER_EXACT
+
+def fuse_scores(index: FaqIndex, methods: list[str], score_matrix: np.ndarray, tier: int,
+                top_n: int = TOP_N_RESULTS):
     """
-    Главная функция поиска. Использует все методы по очереди.
-    Возвращает список: [(вопрос, средняя_оценка), ...] отсортированный по релевантности.
+    Объединение оценок методов: матрица (методы x вопросы) ->
+    [(вопрос, средняя_оценка, число_методов, faq.id, question_hash, уровень_каскада), ...].
+    Оценка засчитывается, если не ниже порога метода; средняя — взвешенная по METHOD_WEIGHTS.
+    Сортировка: сначала по числу методов, потом по средней оценке.
     """
-    all_results = []
+    thresholds = np.array([SEARCH_METHODS[m][1] for m in methods], dtype=np.float32)[:, None]
+    weights = np.array([METHOD_WEIGHTS.get(m, 1.0) for m in methods], dtype=np.float32)[:, None]
+    mask = (score_matrix >= thresholds) & index.alive     # NaN даёт False; удалённые строки не засчитываются
+    counts = mask.sum(axis=0)
+    weight_sum = (mask * weights).sum(axis=0)
+    weighted = np.where(mask, score_matrix * weights, 0).sum(axis=0)
+    means = np.divide(weighted, weight_sum, out=np.zeros_like(weighted), where=weight_sum > 0)
 
-    # 1. TF-IDF
-    all_results.extend(tfidf_search(user_question, faq_questions))
+    hits = np.flatnonzero(counts)
+    # Оценки методов не больше 1, поэтому ключ count*2 + mean упорядочивает сначала по count, потом по mean
+    keys = counts[hits] * 2.0 + np.clip(means[hits], 0.0, 1.0)
+    if len(hits) > top_n:
+        part = np.argpartition(-keys, top_n - 1)[:top_n]
+        hits, keys = hits[part], keys[part]
+    order = hits[np.argsort(-keys, kind="stable")]
+    _log(f"[Combined] Всего кандидатов: {np.count_nonzero(counts)}")
+    return [(index.questions[i], float(means[i]), int(counts[i]), index.ids[i], index.hashes[i], tier)
+            for i in order]
 
-    # 2. Fuzzy
-    all_results.extend(fuzzy_search(user_question, faq_questions))
+def _method_row(method: str, user_question: str, index: FaqIndex, candidates, batch_rows: dict) -> np.ndarray:
+    """Оценки метода для запроса: из пакетно посчитанных, если есть, иначе — вызов метода"""
+    row = batch_rows.get(method)
+    return row if row is not None else SEARCH_METHODS[method][0](user_question, index, candidates)
 
-    # 3. SequenceMatcher
-    all_results.extend(sequence_search(user_question, faq_questions))
+def _vector_tier(user_question: str, index: FaqIndex, candidates, batch_rows: dict):
+    rows = [_method_row(m, user_question, index, candidates, batch_rows) for m in VECTOR_METHODS]
+    return rows, fuse_scores(index, list(VECTOR_METHODS), np.vstack(rows), TIER_VECTOR)
 
-    # 4. Subword
-    all_results.extend(subword_search(user_question, faq_questions))
+def _vector_tier_confident(results) -> bool:
+    return bool(results) and results[0][1] >= CASCADE_VECTOR_CUTOFF and results[0][2] >= CASCADE_VECTOR_MIN_METHODS
 
-    # 5. Levenshtein
-    all_results.extend(levenshtein_search(user_question, faq_questions))
+def _char_tier(user_question: str, index: FaqIndex, candidates, rows: list, batch_rows: dict):
+    rows = rows + [_method_row(m, user_question, index, candidates, batch_rows) for m in CHAR_METHODS]
+    return fuse_scores(index, list(VECTOR_METHODS + CHAR_METHODS), np.vstack(rows), TIER_CHAR)
 
-    # 6. Jaccard
-    all_results.extend(jaccard_search(user_question, faq_questions))
+def find_similar_questions(user_question: str, faq_questions: list[str] | None = None):
+    """
+    Главная функция поиска. Каскад уровней, каждый следующий запускается,
+    только если предыдущий не дал уверенного ответа:
+      0. точное совпадение вопроса;
+      1. векторные методы (TF-IDF, Subword, Jaccard, семантический LSA, полнотекстовый FTS5);
+      2. символьные методы (Fuzzy, SequenceMatcher, Levenshtein).
+    faq_questions=None — искать по текущему загруженному индексу.
+    Возвращает список: [(вопрос, средняя_оценка, число_методов, faq.id, question_hash, уровень_каскада), ...]
+    отсортированный по релевантности; id и хэш берутся из индекса, чтобы ответ можно было найти без поиска по тексту,
+    уровень (TIER_EXACT / TIER_VECTOR / TIER_CHAR) — какой уровень каскада дал результат.
+    """
+    if faq_questions is not None and not faq_questions:
+        return []
+    index = get_faq_index(faq_questions)
+    if not index.n_live:
+        return []
 
-    # ==========================
-    # Комбинируем результаты
-    # ==========================
-    # Считаем среднюю оценку для каждого вопроса, встречающегося в разных методах
-    counter = {}
-    scores = {}
-    for q, score in all_results:
-        if q not in counter:
-            counter[q] = 0
-            scores[q] = []
-        counter[q] += 1
-        scores[q].append(score)
+    # 0. Точное совпадение
+    if CASCADE_EXACT_MATCH:
+        pos = exact_search(user_question, index)
+        if pos is not None:
+            _log(f"[Cascade] Ответ дал уровень 0 (точное совпадение): {index.questions[pos]}")
+            return [_exact_result(index, pos)]
 
-    # Средняя оценка
-    combined_results = [(q, sum(scores[q]) / len(scores[q]), counter[q]) for q in counter]
+    candidates = select_candidates(user_question, index)
 
-    # Сортировка: сначала по количеству совпадений (чем чаще встречался), потом по средней оценке
-    combined_results.sort(key=lambda x: (x[2], x[1]), reverse=True)
+    # 1. Векторные методы
+    rows, combined_results = _vector_tier(user_question, index, candidates, {})
+    tier = TIER_VECTOR
+    if not _vector_tier_confident(combined_results):
+        # 2. Символьные методы
+        tier = TIER_CHAR
+        combined_results = _char_tier(user_question, index, candidates, rows, {})
 
     # Логирование
-    logging.info(f"[Combined] Всего кандидатов: {len(combined_results)}")
-    for q, avg, count in combined_results[:TOP_N_RESULTS]:
-        logging.info(f"Вопрос: {q}, Средняя оценка: {avg:.2f}, Методов: {count}")
+    _log(f"[Cascade] Ответ дал уровень {tier} ({'векторные' if tier == TIER_VECTOR else 'символьные'} методы)")
+    for q, avg, count, *_ in combined_results:
+        _log(f"Вопрос: {q}, Средняя оценка: {avg:.2f}, Методов: {count}")
+
+    return combined_results
+
+def find_similar_questions_batch(user_questions: list[str]) -> list[list[tuple]]:
+    """
+    find_similar_questions для списка запросов по текущему индексу — результаты те же, что по одному.
+    Тяжёлые методы (TF-IDF, Fuzzy, Sequence) считаются пакетно; запросы идут порциями
+    по BATCH_MAX_CELLS / размер FAQ, поэтому память ограничена независимо от длины списка.
+    """
+    index = get_faq_index()
+    if not index.n_live:
+        return [[] for _ in user_questions]
+    chunk = max(1, BATCH_MAX_CELLS // len(index))
+    results = []
+    _search_log.quiet = True
+    try:
+        for start in range(0, len(user_questions), chunk):
+            results.extend(_match_chunk(user_questions[start:start + chunk], index))
+    finally:
+        _search_log.quiet = False
+    return results
+
+def _match_chunk(user_questions: list[str], index: FaqIndex) -> list:
+    results = [None] * len(user_questions)
+    pending = []
+    for i, question in enumerate(user_questions):
+        pos = exact_search(question, index) if CASCADE_EXACT_MATCH else None
+        if pos is not None:
+            results[i] = [_exact_result(index, pos)]
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    candidates = {i: select_candidates(user_questions[i], index) for i in pending}
+    tfidf = tfidf_scores_batch([user_questions[i] for i in pending], index)
+    need_char = {}
+    for j, i in enumerate(pending):
+        rows, combined = _vector_tier(user_questions[i], index, candidates[i], {"tfidf": tfidf[j]})
+        if _vector_tier_confident(combined):
+            results[i] = combined
+        else:
+            need_char[i] = rows
+    del tfidf
+
+    # Пакетно считаем только запросы, которые оцениваются по всему FAQ; с кандидатами — по одному
+    full = [i for i in need_char if candidates[i] is None]
+    char_rows = {}
+    if full:
+        texts = [user_questions[i] for i in full]
+        fuzzy, sequence = fuzzy_scores_batch(texts, index), sequence_scores_batch(texts, index)
+        char_rows = {i: {"fuzzy": fuzzy[j], "sequence": sequence[j]} for j, i in enumerate(full)}
+    for i, rows in need_char.items():
+        results[i] = _char_tier(user_questions[i], index, candidates[i], rows, char_rows.get(i, {}))
+    return results
+
+# ==========================
+# Кэш результатов
+# ==========================
+query_cache = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
 
-    return combined_results[:TOP_N_RESULTS]
+def query_cache_key(user_question: str, faq_version: int, generation: int) -> tuple[int, int, str]:
+    """
+    Ключ кэша: разные формулировки с одинаковой нормализованной формой дают один ключ.
+    generation — поколение индекса, по которому идёт поиск: версия FAQ растёт при синхронизации раньше,
+    чем подменяется индекс, и без поколения результат по старому индексу попал бы в кэш под новой версией.
+    """
+    normalized = preprocess_text(user_question)
+    # Запрос только из стоп-слов нормализуется в пустую строку — тогда ключом служит сам текст
+    return faq_version, generation, normalized or user_question.strip().lower()
 
 # ==========================
 # Функция для ручного добавления вопросов в unanswered
@@ -2,7 +2,7 @@ from core.keyboards import get_main_menu_keyboard
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from .database import insert_user
+from .user_registry import insert_user
 import re
 
 
@@ -34,7 +34,7 @@ async def process_phone(message: types.Message, state: FSMContext):
     phone = message.text
     user = message.from_user
 
-    insert_user(
+    await insert_user(
         user_id=user.id,
         username=user.username or '',
         phone=phone,
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from . import nlp_utils
+from .db_async import get_faq_version
+
+# ==========================
+# Сервис поиска по FAQ вне event loop
+# ==========================
+# Подбор похожих вопросов (sklearn, RapidFuzz, BK-деревья) выполняется в пуле процессов,
+# чтобы обработка одного запроса не останавливала polling и остальные чаты.
+# Каждый процесс загружает индекс с диска: массивы TF-IDF матрицы открываются через mmap,
+# поэтому страницы файлов общие для всех процессов (page cache), а не копируются в каждый.
+# Изменения FAQ процессы подхватывают сами по журналу дельт (nlp_utils.sync_faq_index).
+
+DEFAULT_SEARCH_WORKERS = 2  # Переопределяется переменной окружения SEARCH_WORKERS (0 — поток в этом процессе)
+
+
+_worker_index_dir = nlp_utils.FAQ_INDEX_DIR
+
+
+def _init_worker(index_dir: str):
+    """Инициализация процесса пула: загружаем сохранённый индекс FAQ (load_faq_index сразу готовит его к поиску)"""
+    global _worker_index_dir
+    _worker_index_dir = index_dir
+    if nlp_utils.load_faq_index(index_dir) is None:
+        logging.error(f"[SearchService] Индекс FAQ не найден в {index_dir}")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _search(user_question: str):
+    # Догоняем дельты и компактизацию, сделанные основным процессом
+    nlp_utils.sync_faq_index(_worker_index_dir)
+    return nlp_utils.find_similar_questions(user_question)
+
+
+def _search_batch(user_questions: list[str]):
+    nlp_utils.sync_faq_index(_worker_index_dir)
+    return nlp_utils.find_similar_questions_batch(user_questions)
+
+
+class SearchService:
+    """Пул процессов для find_similar_questions с await-интерфейсом"""
+
+    def __init__(self):
+        self._executor: ProcessPoolExecutor | None = None
+        self.workers = 0
+
+    def start(self, workers: int | None = None, index_dir: str = nlp_utils.FAQ_INDEX_DIR):
+        """Запускает пул; индекс к этому моменту уже должен быть построен (build_faq_index)"""
+        if nlp_utils.QUERY_CACHE_PERSIST:
+            loaded = nlp_utils.query_cache.load(nlp_utils.QUERY_CACHE_FILE)
+            logging.info(f"[SearchService] Загружено запросов в кэш: {loaded}")
+        if workers is None:
+            workers = int(os.getenv("SEARCH_WORKERS", DEFAULT_SEARCH_WORKERS))
+        self.workers = workers
+        if workers <= 0:
+            logging.info("[SearchService] Поиск в отдельном потоке основного процесса")
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(index_dir,),
+        )
+        # Поднимаем все процессы сразу, чтобы первый запрос не ждал загрузки индекса
+        for future in [self._executor.submit(_ping) for _ in range(workers)]:
+            future.result()
+        logging.info(f"[SearchService] Запущено процессов поиска: {workers}")
+
+    async def find_similar(self, user_question: str, faq_version: int | None = None):
+        """
+        find_similar_questions по текущему индексу, не блокируя event loop; повторы отдаются из кэша.
+        faq_version — уже прочитанная вызывающим версия FAQ (None — прочитать из БД).
+        """
+        # Поколение индекса основного процесса: дельты и новая база пишутся на диск до подмены снимка,
+        # поэтому процессы пула ищут по индексу не старее этого поколения
+        generation = nlp_utils.get_faq_index().generation
+        if faq_version is None:
+            faq_version = await get_faq_version()
+        key = nlp_utils.query_cache_key(user_question, faq_version, generation)
+        cached = nlp_utils.query_cache.get(key)
+        if cached is not None:
+            logging.info(f"[QueryCache] Попадание: {nlp_utils.query_cache.stats()}")
+            return cached
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._executor, _search, user_question)
+        nlp_utils.query_cache.put(key, result)
+        return result
+
+    async def find_similar_batch(self, user_questions: list[str]):
+        """find_similar_questions_batch одной задачей пула (фоновые задания; кэш запросов не используется)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, _search_batch, list(user_questions))
+
+    def shutdown(self):
+        """Останавливает пул: ждёт текущие задачи, ещё не начатые отменяет; сохраняет горячие запросы"""
+        if nlp_utils.QUERY_CACHE_PERSIST:
+            try:
+                nlp_utils.query_cache.dump(nlp_utils.QUERY_CACHE_FILE, nlp_utils.QUERY_CACHE_PERSIST)
+            except OSError as e:
+                logging.error(f"[SearchService] Не удалось сохранить кэш запросов: {e}")
+        logging.info(f"[QueryCache] {nlp_utils.query_cache.stats()}")
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            logging.info("[SearchService] Пул поиска остановлен")
+
+
+search_service = SearchService()
@@ -0,0 +1,69 @@
+import logging
+import time
+
+from . import db_async
+from .cache import LRUCache
+
+# ==========================
+# Зарегистрированные пользователи в памяти
+# ==========================
+# is_user_registered вызывается на каждое сообщение, а статус регистрации почти не меняется.
+# Множество id зарегистрированных загружается из users при старте и пополняется при регистрации,
+# поэтому проверка — поиск в set. Отрицательный ответ перепроверяется по БД (пользователя могли
+# добавить в обход бота), но не чаще раза в UNKNOWN_USER_TTL секунд на пользователя.
+
+UNKNOWN_USER_CACHE_SIZE = 10000     # Сколько незарегистрированных id помнить
+UNKNOWN_USER_TTL = 60               # Через сколько секунд снова спросить БД о незарегистрированном
+
+
+class UserRegistry:
+    """Множество id зарегистрированных пользователей + кэш недавних отрицательных ответов БД"""
+
+    def __init__(self):
+        self._registered: set[int] = set()
+        self._unknown = LRUCache(UNKNOWN_USER_CACHE_SIZE, UNKNOWN_USER_TTL)
+        self.hits = 0           # ответ из памяти
+        self.db_checks = 0      # пришлось спросить БД
+
+    def __len__(self):
+        return len(self._registered)
+
+    def stats(self) -> str:
+        total = self.hits + self.db_checks
+        rate = self.hits / total if total else 0.0
+        return (f"пользователей {len(self)}, проверок {total}, из памяти {self.hits} ({rate:.1%}), "
+                f"запросов к БД {self.db_checks}")
+
+    async def load(self):
+        """Загружает id всех зарегистрированных пользователей (при старте)"""
+        started = time.perf_counter()
+        self._registered = set(await db_async.get_registered_user_ids())
+        logging.info(f"[Users] Загружено зарегистрированных: {len(self)} "
+                     f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    def add(self, user_id: int):
+        self._registered.add(user_id)
+
+    async def is_registered(self, user_id: int) -> bool:
+        if user_id in self._registered or self._unknown.get(user_id) is not None:
+            self.hits += 1
+            return user_id in self._registered
+        self.db_checks += 1
+        if await db_async.is_user_registered(user_id):
+            self._registered.add(user_id)
+            return True
+        self._unknown.put(user_id, True)
+        return False
+
+
+user_registry = UserRegistry()
+
+
+async def is_user_registered(user_id: int) -> bool:
+    return await user_registry.is_registered(user_id)
+
+
+async def insert_user(user_id: int, username: str, phone: str, full_name: str):
+    """Регистрирует пользователя в БД и сразу в памяти"""
+    await db_async.insert_user(user_id, username, phone, full_name)
+    user_registry.add(user_id)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+
+from . import db_async
+
+# ==========================
+# Отложенная запись вопросов
+# ==========================
+# Вопросы без ответа и вопросы пользователей не пишутся в БД по одному (коммит на каждое сообщение),
+# а копятся в памяти и сбрасываются пакетом в одной транзакции — когда набралось WRITE_BATCH_SIZE
+# записей или прошло WRITE_FLUSH_INTERVAL секунд с первой из них. При остановке бота drain()
+# дописывает всё накопленное. Если запись не удалась, пакет возвращается в очередь и повторяется.
+
+WRITE_BATCH_SIZE = 200          # Записей, при которых очередь сбрасывается сразу
+WRITE_FLUSH_INTERVAL = 0.5      # Сколько запись может ждать в очереди, секунд
+
+
+class WriteBehindQueue:
+    """Очередь отложенных вставок в unanswered_questions и user_questions"""
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, interval: float = WRITE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._unanswered: list[str] = []
+        self._user_questions: list[tuple[int, str, str | None, str]] = []
+        self._pending = asyncio.Event()     # в очереди что-то есть
+        self._full = asyncio.Event()        # набрался пакет
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.flushes = 0
+        self.written = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self._unanswered) + len(self._user_questions)
+
+    def stats(self) -> str:
+        return (f"в очереди {self.depth}, сбросов {self.flushes}, записано {self.written}, "
+                f"время сброса {self.last_latency * 1000:.1f} мс (макс. {self.max_latency * 1000:.1f} мс)")
+
+    def _added(self):
+        self._pending.set()
+        if self.depth >= self.batch_size:
+            self._full.set()
+
+    def log_unanswered(self, question: str):
+        self._unanswered.append(question)
+        self._added()
+
+    def add_user_question(self, user_id: int, question: str, answer: str | None = None, status: str = "yellow"):
+        self._user_questions.append((user_id, question, answer, status))
+        self._added()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._pending.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            if self._stopping and not self.depth:
+                return
+
+    async def flush(self):
+        """Сбрасывает накопленное одной транзакцией"""
+        self._pending.clear()
+        self._full.clear()
+        unanswered, self._unanswered = self._unanswered, []
+        user_questions, self._user_questions = self._user_questions, []
+        if not unanswered and not user_questions:
+            return
+        started = time.perf_counter()
+        try:
+            await db_async.write_question_batch(unanswered, user_questions)
+        except Exception as e:
+            logging.error(f"[WriteBehind] Ошибка записи пакета ({len(unanswered) + len(user_questions)} записей): {e}")
+            self._unanswered[:0] = unanswered
+            self._user_questions[:0] = user_questions
+            self._pending.set()
+            if self._stopping:
+                raise
+            await asyncio.sleep(self.interval)
+            return
+        self.last_latency = time.perf_counter() - started
+        self.max_latency = max(self.max_latency, self.last_latency)
+        self.flushes += 1
+        self.written += len(unanswered) + len(user_questions)
+
+    async def drain(self):
+        """При остановке: дописывает очередь и завершает фоновую задачу"""
+        self._stopping = True
+        self._pending.set()
+        self._full.set()
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception as e:
+                logging.error(f"[WriteBehind] Очередь не дописана: {e}")
+            self._task = None
+        else:
+            await self.flush()
+        logging.info(f"[WriteBehind] {self.stats()}")
+
+
+write_behind = WriteBehindQueue()
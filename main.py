@@ -6,7 +6,12 @@ from aiogram import Bot, Dispatcher
 from dotenv import load_dotenv
 
 from core.handlers import register_handlers
-from core.database import init_db
+from core import db_async
+from core.search_service import search_service
+from core.backlog import run_backlog_job
+from core.faq_watcher import watch_faq
+from core.user_registry import user_registry
+from core.write_behind import write_behind
 
 # === Логи ===
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -15,23 +20,47 @@ logger = logging.getLogger(__name__)
 # === Токен ===
 load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+FAQ_SOURCE = os.getenv("FAQ_SOURCE", "faq.xlsx")   # xlsx, csv или tsv; изменения подхватываются без перезапуска
 
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
+async def background_jobs():
+    await db_async.run_user_questions_migration()
+    await run_backlog_job()
+    await watch_faq(FAQ_SOURCE)
+
+
 # === Основная функция ===
 async def main():
-    init_db()
-    from core.database import merge_faq_from_excel
+    await db_async.init_db()
+    await user_registry.load()
+    from core.nlp_utils import build_faq_index
     try:
-        new, updated = merge_faq_from_excel("faq.xlsx")
+        new, updated = await db_async.merge_faq_from_excel(FAQ_SOURCE)
         logger.info(f"FAQ синхронизирован. Новые: {new}, Обновленные: {updated}")
     except Exception as e:
         logger.error(f"Ошибка синхронизации FAQ: {e}")
+    build_faq_index(await db_async.get_all_faq_entries())
+    from core.clustering import load_question_clusters
+    await asyncio.to_thread(load_question_clusters)
+    search_service.start()
+    write_behind.start()
+    # В фоне: перенос старых личных таблиц вопросов, перепроверка вопросов без ответа,
+    # затем слежение за файлом FAQ
+    background_task = asyncio.create_task(background_jobs())
 
     await register_handlers(dp)
     logger.info("Запуск бота...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        background_task.cancel()
+        logger.info(f"[Users] {user_registry.stats()}")
+        search_service.shutdown()
+        # Накопленные вопросы дописываются до закрытия подключений
+        await write_behind.drain()
+        db_async.shutdown()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+from core import database
+from core.faq_reader import iter_faq_rows
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def faq_questions() -> list[str]:
+    """Вопросы из faq.xlsx в репозитории"""
+    return [question for chunk in iter_faq_rows(os.path.join(ROOT, "faq.xlsx")) for question, _ in chunk]
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Пустая база во временном каталоге; подключения потоков переоткрываются по новому DB_PATH"""
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "bot_data.db"))
+    database.init_db()
+    yield database.DB_PATH
+    database.close_connections()
@@ -0,0 +1,53 @@
+import csv
+
+import pytest
+
+from core import database, nlp_utils
+from core.backlog import _matched_question
+
+# Пакетный поиск (фоновый повторный поиск) должен давать те же результаты, что поиск по одному запросу,
+# в том числе на FAQ больше CANDIDATE_LIMIT, где оценка идёт по кандидатам из обратного индекса.
+
+SUFFIXES = ["", "на объекте", "для грузовика", "в мороз", "после обновления", "через сервер",
+            "на автобусе", "с двумя сим картами", "без GPS", "при отключённом питании",
+            "в личном кабинете", "на спецтехнике", "с внешней антенной"]
+
+QUERIES = [
+    "как настроить терминал на грузовике",
+    "не работает gps после обновления",
+    "сколько сим карт можно вставить",
+    "индикация светодиодов в мороз",
+    "привет",
+    "акселерометр",
+    "у меня дома кот рыжий пушистый",
+]
+
+
+@pytest.fixture
+def large_faq(tmp_path, temp_db, faq_questions, monkeypatch):
+    """FAQ из вопросов faq.xlsx с дописанными уточнениями — больше CANDIDATE_LIMIT строк, с faq.id и FTS"""
+    questions = list(dict.fromkeys(f"{q} {s}".strip() for s in SUFFIXES for q in faq_questions))
+    assert len(questions) > nlp_utils.CANDIDATE_LIMIT
+    path = tmp_path / "faq.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["question", "answer"])
+        writer.writerows((q, f"Ответ {i}") for i, q in enumerate(questions))
+    database.merge_faq_from_excel(str(path))
+    index = nlp_utils._fit_index(database.get_all_faq_entries())
+    monkeypatch.setattr(nlp_utils, "_faq_index", index)
+    return questions
+
+
+def test_batch_matches_single(large_faq):
+    queries = large_faq[::97] + [q.lower()[:30] for q in large_faq[5::211]] + QUERIES
+    assert nlp_utils.find_similar_questions_batch(queries) == [nlp_utils.find_similar_questions(q) for q in queries]
+
+
+def test_cascade_tier(large_faq):
+    exact = nlp_utils.find_similar_questions(large_faq[10])
+    assert [r[0] for r in exact] == [large_faq[10]] and exact[0][5] == nlp_utils.TIER_EXACT
+    assert _matched_question(exact) == large_faq[10]
+    for query in QUERIES:
+        for result in nlp_utils.find_similar_questions(query):
+            assert result[5] in (nlp_utils.TIER_VECTOR, nlp_utils.TIER_CHAR)
@@ -0,0 +1,34 @@
+import os
+
+from core import database
+
+
+def _write(path, rows):
+    path.write_text("question,answer\n" + "".join(f"{q},{a}\n" for q, a in rows), encoding="utf-8")
+
+
+def test_merge_skips_unchanged_file_without_hashing(tmp_path, temp_db, monkeypatch):
+    path = tmp_path / "faq.csv"
+    _write(path, [("Как сбросить настройки?", "Кнопкой"), ("Как обновить прошивку?", "Через сервер")])
+    assert database.merge_faq_from_excel(str(path)) == (2, 0)
+
+    hashed = []
+    file_hash = database._file_hash
+    monkeypatch.setattr(database, "_file_hash", lambda p: hashed.append(p) or file_hash(p))
+
+    # mtime и размер те же — файл не читается
+    assert database.merge_faq_from_excel(str(path)) == (0, 0)
+    assert hashed == []
+
+    # Перезаписан тем же содержимым — хэш сверяется, импорт пропускается
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert database.merge_faq_from_excel(str(path)) == (0, 0)
+    assert len(hashed) == 1
+    assert database.merge_faq_from_excel(str(path)) == (0, 0)
+    assert len(hashed) == 1
+
+    # Содержимое изменилось — строки импортируются
+    _write(path, [("Как сбросить настройки?", "Кнопкой RESET"), ("Как обновить прошивку?", "Через сервер")])
+    assert database.merge_faq_from_excel(str(path)) == (0, 1)
+    assert len(hashed) == 2
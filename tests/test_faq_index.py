@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from core import nlp_utils
+from core.faq_index import FaqIndex, append_delta_log
+
+# Индекс после дельты должен совпадать с индексом, заново обученным по тем же живым строкам,
+# а сохранённая база + журнал дельт — загружаться в то же состояние.
+
+
+@pytest.fixture
+def entries(faq_questions):
+    return nlp_utils._prepare_entries([(i, q, None, None) for i, q in enumerate(faq_questions, start=1)])
+
+
+@pytest.fixture
+def delta(entries):
+    """Удалено каждое седьмое, изменено каждое одиннадцатое, добавлены новые вопросы"""
+    deleted = [e[0] for e in entries[::7]]
+    changed = [(faq_id, question + " для терминала", None, None)
+               for faq_id, question, _, _ in entries[3::11] if faq_id not in deleted]
+    new = [(len(entries) + i, q, None, None) for i, q in enumerate(
+        ["Как обновить прошивку терминала удалённо?", "Почему не горит индикатор питания?", "Акселерометр калибровка"],
+        start=1)]
+    return nlp_utils._prepare_entries(changed + new), deleted
+
+
+@pytest.fixture
+def queries(entries):
+    return [nlp_utils.preprocess_text(q) for q in
+            [e[1] for e in entries[::9]] + ["прошивка терминала", "индикатор питания", "калибровка акселерометра"]]
+
+
+@pytest.fixture(autouse=True)
+def isolated_index(monkeypatch):
+    """Тесты не трогают индекс процесса"""
+    monkeypatch.setattr(nlp_utils, "_faq_index", None)
+    monkeypatch.setattr(nlp_utils, "_index_sync", {"current": None, "log": None, "offset": 0})
+
+
+def _assert_same_scores(index: FaqIndex, refit: FaqIndex, queries: list[str]):
+    assert index.live_questions == refit.questions
+    assert index.live_entries() == refit.live_entries()
+    live = np.flatnonzero(index.alive)
+    for query in queries:
+        np.testing.assert_allclose(index.tfidf_scores(query)[live], refit.tfidf_scores(query), atol=1e-5)
+    np.testing.assert_allclose(index.tfidf_scores_batch(queries)[:, live], refit.tfidf_scores_batch(queries),
+                               atol=1e-5)
+
+
+def test_delta_matches_refit(entries, delta, queries):
+    index = FaqIndex.fit(entries).apply_delta(*delta)
+    assert index.generation == 1
+    assert index.n_live == len(entries) - len(delta[1]) + 3
+    _assert_same_scores(index, FaqIndex.fit(index.live_entries()), queries)
+
+
+def test_save_delta_log_load_round_trip(tmp_path, entries, delta, queries):
+    index_dir = str(tmp_path / "faq_index")
+    base = nlp_utils._fit_index(entries)
+    nlp_utils._save_index(base, index_dir)
+    updated = base.apply_delta(*delta)
+    append_delta_log(index_dir, updated.generation, *delta)
+
+    loaded = nlp_utils.load_faq_index(index_dir)
+    assert loaded is not None
+    # Загруженный индекс уже готов к поиску: первый запрос не строит обратные индексы и BK-деревья
+    assert loaded.base.token_postings is not None and loaded.base.trigram_postings is not None
+    assert loaded.base.edit_index is not None and loaded.base.fuzzy_questions is not None
+    assert loaded.generation == updated.generation
+    assert loaded.ids == updated.ids and loaded.hashes == updated.hashes
+    np.testing.assert_array_equal(loaded.alive, updated.alive)
+    _assert_same_scores(loaded, FaqIndex.fit(updated.live_entries()), queries)
+    for query in queries:
+        np.testing.assert_allclose(loaded.tfidf_scores(query), updated.tfidf_scores(query), atol=1e-6)
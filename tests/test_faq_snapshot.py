@@ -0,0 +1,20 @@
+import asyncio
+
+from core import database, faq_snapshot
+
+
+def test_snapshot_follows_faq_version(tmp_path, temp_db, monkeypatch):
+    monkeypatch.setattr(faq_snapshot, "_snapshot", faq_snapshot.FaqSnapshot(-1, 0))
+    path = tmp_path / "faq.csv"
+    path.write_text("question,answer\nКак сбросить настройки?,Кнопкой\n", encoding="utf-8")
+    database.merge_faq_from_excel(str(path))
+
+    snapshot = asyncio.run(faq_snapshot.get_faq_snapshot())
+    assert (snapshot.version, len(snapshot)) == (database.get_faq_version(), 1)
+    assert asyncio.run(faq_snapshot.get_faq_snapshot()) is snapshot
+
+    path.write_text("question,answer\nКак сбросить настройки?,Кнопкой\nКак обновить прошивку?,Через сервер\n",
+                    encoding="utf-8")
+    database.merge_faq_from_excel(str(path))
+    updated = asyncio.run(faq_snapshot.get_faq_snapshot())
+    assert updated.version > snapshot.version and len(updated) == 2
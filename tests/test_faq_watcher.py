@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+from core import database, faq_watcher, nlp_utils
+
+
+def _write(path, questions):
+    path.write_text("question,answer\n" + "".join(f"{q},Ответ\n" for q in questions), encoding="utf-8")
+
+
+def test_index_catches_up_after_failed_refresh(tmp_path, temp_db, monkeypatch):
+    index_dir = tmp_path / "faq_index"
+    index_dir.mkdir()
+    path = tmp_path / "faq.csv"
+    _write(path, ["Как сбросить настройки?", "Как обновить прошивку?"])
+    database.merge_faq_from_excel(str(path))
+    monkeypatch.setattr(nlp_utils, "_faq_index", nlp_utils._fit_index(database.get_all_faq_entries()))
+
+    failures = [RuntimeError("refresh failed")]
+
+    def refresh(entries):
+        if failures:
+            raise failures.pop()
+        return nlp_utils.refresh_faq_index(entries, index_dir=str(index_dir))
+
+    monkeypatch.setattr(faq_watcher, "refresh_faq_index", refresh)
+    _write(path, ["Как сбросить настройки?", "Как обновить прошивку?", "Почему не горит индикатор?"])
+
+    # Импорт записан, обновление индекса упало
+    with pytest.raises(RuntimeError):
+        asyncio.run(faq_watcher.reload_faq(str(path)))
+    # Повторный импорт ничего не находит, но индекс всё равно догоняет БД
+    assert asyncio.run(faq_watcher.reload_faq(str(path)))
+    assert "Почему не горит индикатор?" in nlp_utils.get_faq_index().live_questions
+    assert not asyncio.run(faq_watcher.reload_faq(str(path)))
@@ -0,0 +1,52 @@
+import math
+import os
+
+import numpy as np
+import pytest
+
+from core import database, nlp_utils
+from core.backlog import _matched_question
+from tests.conftest import ROOT
+
+# FTS-оценка абсолютная (bm25 / сумма idf стемов запроса): лучшее найденное совпадение по одному слову
+# длинного постороннего запроса не должно проходить порог и давать ложный ответ.
+
+UNRELATED = [
+    "у меня дома кот рыжий пушистый и ещё акселерометр",
+    "собака кошка мышь индикаторы трактор",
+    "расскажите мне про погоду в москве и прошивку",
+]
+RELATED = ["как обновить прошивку", "не работает gps", "что означают светодиодные"]
+
+
+@pytest.fixture
+def faq_index(temp_db, monkeypatch):
+    database.merge_faq_from_excel(os.path.join(ROOT, "faq.xlsx"))
+    index = nlp_utils._fit_index(database.get_all_faq_entries())
+    monkeypatch.setattr(nlp_utils, "_faq_index", index)
+    return index
+
+
+@pytest.mark.parametrize("query", UNRELATED)
+def test_partial_overlap_is_not_a_match(faq_index, query):
+    assert np.nanmax(nlp_utils.fts_scores(query, faq_index)) < nlp_utils.FTS_THRESHOLD
+    assert _matched_question(nlp_utils.find_similar_questions(query)) is None
+
+
+@pytest.mark.parametrize("query", RELATED)
+def test_related_query_scores_high(faq_index, query):
+    assert np.nanmax(nlp_utils.fts_scores(query, faq_index)) >= nlp_utils.FTS_THRESHOLD
+    assert _matched_question(nlp_utils.find_similar_questions(query)) is not None
+
+
+def test_faq_question_matches_itself(faq_index):
+    # Длинные вопросы bm25 штрафует за длину, но почти все вопросы FAQ проходят порог сами по себе
+    own = [nlp_utils.fts_scores(q, faq_index)[pos] for pos, q in enumerate(faq_index.questions)]
+    assert np.mean(np.nan_to_num(own) >= nlp_utils.FTS_THRESHOLD) >= 0.95
+
+
+def test_vocab_created_for_existing_database(temp_db):
+    with database._connect() as conn:
+        conn.execute("DROP TABLE faq_fts_vocab")
+    database.init_db()
+    assert database.fts_idf(["прошивк"], 10) == [pytest.approx(math.log(10.5 / 0.5))]
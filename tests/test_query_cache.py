@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+
+from core import database, nlp_utils
+from core.cache import LRUCache
+from core.search_service import SearchService
+
+QUERY = "обновить прошивку удалённо"
+
+
+def _write(path, questions):
+    path.write_text("question,answer\n" + "".join(f"{q},Ответ\n" for q in questions), encoding="utf-8")
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(nlp_utils, "query_cache", LRUCache(100, 3600))
+    monkeypatch.setattr(nlp_utils, "_index_owner", True)    # поиск в потоке этого процесса, без sync с диска
+    return SearchService()
+
+
+def test_results_cached_before_index_swap_are_not_reused(tmp_path, temp_db, service, monkeypatch):
+    index_dir = tmp_path / "faq_index"
+    index_dir.mkdir()
+    path = tmp_path / "faq.csv"
+    _write(path, ["Как сбросить настройки?", "Как обновить прошивку?", "Почему не горит индикатор?"])
+    database.merge_faq_from_excel(str(path))
+    monkeypatch.setattr(nlp_utils, "_faq_index", nlp_utils._fit_index(database.get_all_faq_entries()))
+
+    _write(path, ["Как сбросить настройки?", "Как обновить прошивку?", "Почему не горит индикатор?",
+                  "Как обновить прошивку терминала удалённо?"])
+    database.merge_faq_from_excel(str(path))
+
+    # Версия FAQ уже новая, а индекс ещё старый: результат по старому индексу попадает в кэш
+    stale = asyncio.run(service.find_similar(QUERY))
+    nlp_utils.refresh_faq_index(database.get_all_faq_entries(), index_dir=str(index_dir))
+
+    fresh = asyncio.run(service.find_similar(QUERY))
+    assert fresh == nlp_utils.find_similar_questions(QUERY)
+    assert fresh != stale
+    assert "Как обновить прошивку терминала удалённо?" in [r[0] for r in fresh]
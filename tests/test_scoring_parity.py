@@ -0,0 +1,68 @@
+from difflib import SequenceMatcher
+
+import numpy as np
+import pytest
+from fuzzywuzzy import fuzz as fuzzywuzzy_fuzz
+
+from core import nlp_utils
+
+# Пакетные Fuzzy и Sequence должны давать те же оценки, что прежние построчные
+# fuzzywuzzy.fuzz.token_set_ratio и difflib.SequenceMatcher, чтобы пороги не пришлось менять.
+
+FREE_QUERIES = [
+    "как настроить терминал",
+    "не работает gps",
+    "сколько сим карт можно вставить",
+    "индикация светодиодов",
+    "АСН терминал сервер мониторинга",
+    "Что означает красный индикатор?",
+    "акселерометр",
+    "привет",
+]
+
+
+@pytest.fixture(scope="module")
+def index(faq_questions):
+    return nlp_utils._fit_index(nlp_utils._prepare_entries([(None, q, None, None) for q in faq_questions]))
+
+
+@pytest.fixture(scope="module")
+def queries(faq_questions):
+    # Сами вопросы FAQ, их искажённые варианты и запросы «из жизни»
+    sample = faq_questions[::5]
+    variants = [q.lower()[: max(10, len(q) // 2)] for q in sample] + [q.replace("а", "о") for q in sample[:10]]
+    return sample + variants + FREE_QUERIES
+
+
+def test_fuzzy_scores_match_fuzzywuzzy(index, queries):
+    threshold = nlp_utils.FUZZY_THRESHOLD
+    for query in queries:
+        scores = nlp_utils.fuzzy_scores(query, index) * 100
+        for question, score in zip(index.questions, scores):
+            expected = fuzzywuzzy_fuzz.token_set_ratio(query, question)
+            if expected >= threshold:
+                assert score == pytest.approx(expected, abs=1e-3), (query, question)
+            else:
+                assert not score >= threshold, (query, question)
+
+
+def test_sequence_scores_match_sequence_matcher(index, queries):
+    threshold = nlp_utils.SEQUENCE_THRESHOLD
+    for query in queries:
+        scores = nlp_utils.sequence_scores(query, index)
+        for question, score in zip(index.questions, scores):
+            expected = SequenceMatcher(None, query, question).ratio()
+            if expected >= threshold:
+                assert score == pytest.approx(expected, abs=1e-6), (query, question)
+            else:
+                assert not score >= threshold, (query, question)
+
+
+def test_batch_scores_match_single(index, queries):
+    batch_queries = queries[:20]
+    np.testing.assert_allclose(
+        nlp_utils.fuzzy_scores_batch(batch_queries, index),
+        np.vstack([nlp_utils.fuzzy_scores(q, index) for q in batch_queries]), atol=1e-6)
+    np.testing.assert_allclose(
+        nlp_utils.sequence_scores_batch(batch_queries, index),
+        np.vstack([nlp_utils.sequence_scores(q, index) for q in batch_queries]), atol=1e-6)
@@ -0,0 +1,63 @@
+from core import database
+
+
+def _legacy_table(user_id: int, questions: list[str], link: bool = True) -> str:
+    """Личная таблица вопросов в том виде, в каком её создавала прежняя версия бота"""
+    table_name = f"user_questions_{user_id}"
+    with database._connect() as conn:
+        conn.execute(f'''CREATE TABLE {table_name} (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            question TEXT,
+                            answer TEXT,
+                            status TEXT CHECK(status IN ('green','yellow','red')) DEFAULT 'yellow',
+                            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                        )''')
+        conn.executemany(f"INSERT INTO {table_name} (question) VALUES (?)", [(q,) for q in questions])
+        if link:
+            conn.execute("UPDATE users SET questions_table = ? WHERE user_id = ?", (table_name, user_id))
+        conn.commit()
+    return table_name
+
+
+def _tables() -> set[str]:
+    with database._connect() as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_re_registration_keeps_legacy_questions(temp_db):
+    database.insert_user(7, "old", "+7000", "Old Name")
+    _legacy_table(7, ["Как сбросить настройки?", "Как обновить прошивку?"])
+
+    database.insert_user(7, "new", "+7001", "New Name")
+    assert [row[1] for row in database.get_user_questions(7)] == ["Как сбросить настройки?", "Как обновить прошивку?"]
+
+    assert database.migrate_user_questions() == (2, 0)
+    assert "user_questions_7" not in _tables()
+    assert [row[1:] for row in database.get_user_questions(7)] == [
+        ("Как сбросить настройки?", None, "yellow", False), ("Как обновить прошивку?", None, "yellow", False)]
+
+
+def test_unlinked_legacy_table_is_migrated(temp_db):
+    # Регистрация прежней версией (INSERT OR REPLACE) уже обнулила questions_table
+    database.insert_user(8, "user", "+7002", "Name")
+    _legacy_table(8, ["Почему не горит индикатор?"], link=False)
+
+    assert database.get_backlog_tables() == ["unanswered_questions", "user_questions", "user_questions_8"]
+    assert [row[1] for row in database.get_user_questions(8)] == ["Почему не горит индикатор?"]
+    assert database.migrate_user_questions() == (1, 0)
+    assert "user_questions_8" not in _tables()
+    assert [row[1] for row in database.get_user_questions(8)] == ["Почему не горит индикатор?"]
+
+
+def test_delete_distinguishes_legacy_and_new_ids(temp_db):
+    database.insert_user(9, "user", "+7003", "Name")
+    _legacy_table(9, ["Старый вопрос"])
+    database.add_user_question(9, "Новый вопрос")
+    rows = database.get_user_questions(9)
+    assert [(row[1], row[4]) for row in rows] == [("Старый вопрос", True), ("Новый вопрос", False)]
+    assert rows[0][0] == rows[1][0] == 1    # номера строк в двух таблицах совпадают
+
+    assert database.delete_user_question(9, 1)
+    assert [row[1] for row in database.get_user_questions(9)] == ["Старый вопрос"]
+    assert database.delete_user_question(9, 1, legacy=True)
+    assert database.get_user_questions(9) == []